@@ -1,9 +1,43 @@
+import asyncio
+import hashlib
+import json
 import logging
+import re
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Generator
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
+from typing import Any
 
 import anthropic
+import httpx
+
+from response_cache import contains_pii
 
 logger = logging.getLogger(__name__)
 
+# Tool "no results" replies are short sentinels such as "No relevant content
+# found." or "Tool 'x' not found"; real results are much longer
+_NO_RESULTS_RE = re.compile(r"^no |not found", re.IGNORECASE)
+_NO_RESULTS_MAX_LENGTH = 200
+
+# HTTP/2 lets concurrent calls share one connection, but needs the optional h2
+# package (pip install "httpx[http2]"); fall back to pooled HTTP/1.1 without it
+_HTTP2_AVAILABLE = find_spec("h2") is not None
+
+
+def _json_default(value: Any) -> Any:
+    """Serialize SDK content blocks echoed back in messages for request hashing"""
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return str(value)
+
+
+def _canonical_json(value: Any) -> bytes:
+    """Encode a request value as canonical JSON for request hashing"""
+    return json.dumps(value, sort_keys=True, default=_json_default).encode("utf-8")
+
 
 class AIGenerator:
     """Handles interactions with Anthropic's Claude API for generating responses"""
@@ -54,14 +88,98 @@ All responses must be:
 Provide only the direct answer to what was asked.
 """
 
-    def __init__(self, api_key: str, model: str, max_tool_rounds: int = 2):
-        self.client = anthropic.Anthropic(api_key=api_key)
+    # Canned replies returned when generation fails part-way; never cache these
+    TOOL_ROUND_ERROR_RESPONSE = "I encountered an error while processing your request."
+    FINAL_CALL_ERROR_RESPONSE = (
+        "I gathered information but encountered an error generating the final response."
+    )
+    EMPTY_RESPONSE = "I apologize, but I couldn't generate a response."
+    NO_TEXT_RESPONSE = "I couldn't generate a proper response."
+    FALLBACK_RESPONSES = frozenset(
+        {
+            TOOL_ROUND_ERROR_RESPONSE,
+            FINAL_CALL_ERROR_RESPONSE,
+            EMPTY_RESPONSE,
+            NO_TEXT_RESPONSE,
+        }
+    )
+
+    # Beta header that makes tool_use output shorter; Claude 3.7 Sonnet needs
+    # it, Claude 4 models are token-efficient without it
+    TOKEN_EFFICIENT_TOOLS_BETA = "token-efficient-tools-2025-02-19"
+
+    # Connection pool shared by all calls on each client, so TLS sessions are reused
+    HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        max_tool_rounds: int = 2,
+        max_concurrent_requests: int = 32,
+        create_cache_size: int = 0,
+        token_efficient_tools: bool = False,
+        tool_result_rounds_kept: int = 0,
+    ):
+        self.client = anthropic.Anthropic(
+            api_key=api_key,
+            http_client=anthropic.DefaultHttpxClient(
+                http2=_HTTP2_AVAILABLE, limits=self.HTTP_LIMITS
+            ),
+        )
+        self.async_client = anthropic.AsyncAnthropic(
+            api_key=api_key,
+            http_client=anthropic.DefaultAsyncHttpxClient(
+                http2=_HTTP2_AVAILABLE, limits=self.HTTP_LIMITS
+            ),
+        )
         self.model = model
         self.max_tool_rounds = max_tool_rounds
 
+        # Tool rounds whose results are re-sent in full on later calls; older
+        # results are elided to save input tokens. 0 keeps every result.
+        self.tool_result_rounds_kept = tool_result_rounds_kept
+
         # Pre-build base API parameters
         self.base_params = {"model": self.model, "temperature": 0, "max_tokens": 800}
 
+        # Static system prompt block, marked so Anthropic caches the prompt prefix
+        self._system_blocks = [
+            {
+                "type": "text",
+                "text": self.SYSTEM_PROMPT,
+                "cache_control": {"type": "ephemeral"},
+            }
+        ]
+
+        # Tool params for the last tools list seen; callers pass the same list
+        # on every call, so these are built once rather than per request
+        self._tools_params: tuple[list, dict[str, Any]] | None = None
+
+        # Sent with every request that offers tools when the beta is enabled
+        self._tools_headers = (
+            {"anthropic-beta": self.TOKEN_EFFICIENT_TOOLS_BETA}
+            if token_efficient_tools
+            else None
+        )
+
+        # Caps in-flight Claude API calls made from the async path
+        self._request_slots = asyncio.Semaphore(max_concurrent_requests)
+
+        # Claude responses keyed by a hash of the full request, least recently
+        # used first; identical requests skip the API call. Tool results are
+        # part of the request, so a changed knowledge base never hits a stale
+        # entry. Requests carrying personal data are never cached, as in
+        # SemanticCache. Disabled when create_cache_size is 0.
+        self.create_cache_size = create_cache_size
+        self._create_cache: OrderedDict[bytes, Any] = OrderedDict()
+
+        # Encodings of the request values that are the same object on every
+        # call, so hashing a request only encodes what changes: the static
+        # system blocks up front, the last tools list seen on first use
+        self._system_json = _canonical_json(self._system_blocks)
+        self._tools_json: tuple[list, bytes] | None = None
+
     def generate_response(
         self,
         query: str,
@@ -84,127 +202,565 @@ Provide only the direct answer to what was asked.
         Returns:
             Generated response as string
         """
+        loop = self._tool_loop(query, conversation_history, tools, tool_manager)
+        try:
+            request = next(loop)
+            while True:
+                try:
+                    if isinstance(request, dict):
+                        result = self._cached_create(request)
+                    else:
+                        result = self._execute_tools(request, tool_manager)
+                except Exception as e:
+                    request = loop.throw(e)
+                else:
+                    request = loop.send(result)
+        except StopIteration as done:
+            return done.value
 
-        # 1. Build system content
-        system_content = (
-            f"{self.SYSTEM_PROMPT}\n\nPrevious conversation:\n{conversation_history}"
-            if conversation_history
-            else self.SYSTEM_PROMPT
+    async def agenerate_response(
+        self,
+        query: str,
+        conversation_history: str | None = None,
+        tools: list | None = None,
+        tool_manager=None,
+    ) -> str:
+        """
+        Async variant of generate_response used by the API server.
+
+        Runs the same tool loop, but awaits Claude API calls on the async client
+        so concurrent requests overlap instead of blocking the event loop.
+        In-flight calls are capped by max_concurrent_requests, and all tool_use
+        blocks from one turn execute concurrently.
+        """
+        loop = self._tool_loop(query, conversation_history, tools, tool_manager)
+        try:
+            request = next(loop)
+            while True:
+                try:
+                    if isinstance(request, dict):
+                        result = await self._acached_create(request)
+                    else:
+                        result = await self._aexecute_tools(request, tool_manager)
+                except Exception as e:
+                    request = loop.throw(e)
+                else:
+                    request = loop.send(result)
+        except StopIteration as done:
+            return done.value
+
+    async def astream_response(
+        self,
+        query: str,
+        conversation_history: str | None = None,
+        tools: list | None = None,
+        tool_manager=None,
+    ) -> AsyncIterator[dict[str, Any]]:
+        """
+        Streaming variant of agenerate_response.
+
+        Every Claude call is streamed and each text delta is yielded as a
+        {"type": "text", "text": ...} event, so the final answer reaches the
+        client token by token. Each tool starts as soon as its tool_use block
+        is complete, while Claude is still decoding the rest of the turn.
+
+        Text from a turn that goes on to call tools (e.g. "Let me search...")
+        is not part of the answer; an {"type": "interim"} event marks
+        everything streamed since the previous marker as such. If the answer
+        is not what was streamed last (e.g. a fallback reply after an API
+        error), an interim marker and the answer's full text follow. The last
+        event is always {"type": "answer", "text": ..., "fallback": ...} with
+        the same text agenerate_response would return.
+        """
+        loop = self._tool_loop(query, conversation_history, tools, tool_manager)
+        # Text streamed since the last interim marker
+        streamed: list[str] = []
+        # Tools already started from the stream, by tool_use id
+        started: dict[str, asyncio.Task] = {}
+        try:
+            request = next(loop)
+            while True:
+                try:
+                    if isinstance(request, dict):
+                        if streamed:
+                            # Another call means the previous turn used tools
+                            yield {"type": "interim"}
+                            streamed = []
+                        async with (
+                            self._request_slots,
+                            self.async_client.messages.stream(**request) as stream,
+                        ):
+                            async for event in stream:
+                                if event.type == "text":
+                                    streamed.append(event.text)
+                                    yield {"type": "text", "text": event.text}
+                                elif (
+                                    tool_manager
+                                    and event.type == "content_block_stop"
+                                    and event.content_block.type == "tool_use"
+                                ):
+                                    block = event.content_block
+                                    started[block.id] = asyncio.create_task(
+                                        tool_manager.aexecute_tool_with_sources(
+                                            block.name, **block.input
+                                        )
+                                    )
+                            result = await stream.get_final_message()
+                    else:
+                        result = await self._aexecute_tools(
+                            request, tool_manager, started
+                        )
+                except Exception as e:
+                    request = loop.throw(e)
+                else:
+                    request = loop.send(result)
+        except StopIteration as done:
+            answer = done.value
+            if answer != "".join(streamed):
+                if streamed:
+                    yield {"type": "interim"}
+                yield {"type": "text", "text": answer}
+            yield {
+                "type": "answer",
+                "text": answer,
+                "fallback": answer in self.FALLBACK_RESPONSES,
+            }
+        finally:
+            # Tools the loop never asked for, e.g. after a truncated turn
+            for task in started.values():
+                task.cancel()
+
+    def _cached_create(self, request: dict[str, Any]):
+        """Call messages.create unless an identical request was answered before"""
+        key = self._request_key(request) if self._cacheable(request) else None
+        response = self._create_cache_get(key)
+        if response is None:
+            response = self.client.messages.create(**request)
+            self._create_cache_put(key, response)
+        return response
+
+    async def _acached_create(self, request: dict[str, Any]):
+        """Async variant of _cached_create; only API calls take a request slot"""
+        key = self._request_key(request) if self._cacheable(request) else None
+        response = self._create_cache_get(key)
+        if response is None:
+            async with self._request_slots:
+                response = await self.async_client.messages.create(**request)
+            self._create_cache_put(key, response)
+        return response
+
+    def _cacheable(self, request: dict[str, Any]) -> bool:
+        """Whether the create cache may hold request: enabled, and no user PII"""
+        if not self.create_cache_size:
+            return False
+        # The user's text is the question plus any history after the static
+        # system blocks; tool results come from course materials, not the user
+        user_texts = [
+            message["content"]
+            for message in request["messages"]
+            if message["role"] == "user" and isinstance(message["content"], str)
+        ]
+        user_texts += [
+            block["text"] for block in request["system"][len(self._system_blocks) :]
+        ]
+        return not any(contains_pii(text) for text in user_texts)
+
+    def _request_key(self, request: dict[str, Any]) -> bytes:
+        """Hash the canonical JSON form of a request's parameters"""
+        digest = hashlib.sha256()
+        for name in sorted(request):
+            value = request[name]
+            if value is self._system_blocks:
+                encoded = self._system_json
+            elif name == "tools":
+                if self._tools_json is None or self._tools_json[0] is not value:
+                    self._tools_json = (value, _canonical_json(value))
+                encoded = self._tools_json[1]
+            else:
+                encoded = _canonical_json(value)
+            digest.update(name.encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(encoded)
+            digest.update(b"\0")
+        return digest.digest()
+
+    def _create_cache_get(self, key: bytes | None):
+        """Return the cached response for key, marking it recently used"""
+        if key is None:
+            return None
+        response = self._create_cache.get(key)
+        if response is not None:
+            self._create_cache.move_to_end(key)
+        return response
+
+    def _create_cache_put(self, key: bytes | None, response):
+        """Store a response, evicting the least recently used one when full"""
+        if key is None:
+            return
+        self._create_cache[key] = response
+        if len(self._create_cache) > self.create_cache_size:
+            self._create_cache.popitem(last=False)
+
+    def _execute_tools(self, tool_blocks: list, tool_manager) -> list[str]:
+        """
+        Run the tool_use blocks of one turn, several at once in threads.
+
+        Results come back in block order, and the blocks' sources are recorded
+        in block order once all have finished, so they never depend on which
+        thread finishes last.
+        """
+        if len(tool_blocks) == 1:
+            block = tool_blocks[0]
+            return [tool_manager.execute_tool(block.name, **block.input)]
+        with ThreadPoolExecutor(max_workers=len(tool_blocks)) as pool:
+            outcomes = list(
+                pool.map(
+                    lambda block: tool_manager.execute_tool_with_sources(
+                        block.name, **block.input
+                    ),
+                    tool_blocks,
+                )
+            )
+        tool_manager.record_sources([sources for _, sources in outcomes])
+        return [result for result, _ in outcomes]
+
+    async def _aexecute_tools(
+        self,
+        tool_blocks: list,
+        tool_manager,
+        started: dict[str, asyncio.Task] | None = None,
+    ) -> list[str]:
+        """
+        Run all tool_use blocks of one turn concurrently, results in block order.
+
+        Blocks whose tool is already running in started (keyed by tool_use id)
+        are awaited rather than run again, and removed from it. Sources are
+        recorded in block order once all blocks finish, as in _execute_tools.
+        """
+        started = {} if started is None else started
+        outcomes = await asyncio.gather(
+            *(
+                started.pop(block.id, None)
+                or tool_manager.aexecute_tool_with_sources(block.name, **block.input)
+                for block in tool_blocks
+            )
         )
+        tool_manager.record_sources([sources for _, sources in outcomes])
+        return [result for result, _ in outcomes]
+
+    def generate_batch(
+        self,
+        queries: list[str],
+        conversation_histories: list[str | None] | None = None,
+        poll_interval: float = 10.0,
+    ) -> list[str]:
+        """
+        Generate answers for many queries through the Message Batches API.
+
+        Batched requests cost half as much but may take minutes to complete,
+        so this is for offline and evaluation runs, not the chat endpoint.
+        Batches cannot run the tool loop, so answers come from the model alone.
+
+        Args:
+            queries: The questions to answer
+            conversation_histories: Optional history for each query
+            poll_interval: Seconds to wait between batch status checks
+
+        Returns:
+            Generated responses in the same order as queries
+        """
+        if conversation_histories is None:
+            conversation_histories = [None] * len(queries)
+        if len(conversation_histories) != len(queries):
+            raise ValueError(
+                f"Got {len(conversation_histories)} histories for {len(queries)} queries"
+            )
+
+        requests = [
+            {
+                "custom_id": str(index),
+                "params": {
+                    **self.base_params,
+                    "system": self._build_system(history),
+                    "messages": [{"role": "user", "content": query}],
+                },
+            }
+            for index, (query, history) in enumerate(
+                zip(queries, conversation_histories, strict=True)
+            )
+        ]
+
+        batch = self.client.messages.batches.create(requests=requests)
+        logger.info(
+            "Submitted message batch %s with %d requests", batch.id, len(requests)
+        )
+        while batch.processing_status != "ended":
+            time.sleep(poll_interval)
+            batch = self.client.messages.batches.retrieve(batch.id)
+
+        responses = [self.EMPTY_RESPONSE] * len(queries)
+        for entry in self.client.messages.batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                responses[int(entry.custom_id)] = self._extract_text(
+                    entry.result.message
+                )
+            else:
+                logger.error(
+                    "Batch request %s did not succeed: %s",
+                    entry.custom_id,
+                    entry.result.type,
+                )
+        return responses
+
+    async def warmup(self):
+        """
+        Open pooled connections to the API before the first real request.
+
+        Lists models rather than sending a message, so warming up costs no
+        tokens. Failures are logged, not raised: the first request simply
+        pays the connection setup instead.
+        """
+        try:
+            await asyncio.gather(
+                asyncio.to_thread(self.client.models.list, limit=1),
+                self.async_client.models.list(limit=1),
+            )
+        except Exception as e:
+            logger.warning("Anthropic client warmup failed: %s", e)
+
+    async def aclose(self):
+        """Close the pooled HTTP connections held by both API clients"""
+        self.client.close()
+        await self.async_client.close()
+
+    def _get_tools_params(self, tools: list) -> dict[str, Any]:
+        """Return the tools/tool_choice params, rebuilt only when the list changes"""
+        if self._tools_params is None or self._tools_params[0] is not tools:
+            params = {"tools": tools, "tool_choice": {"type": "auto"}}
+            if self._tools_headers:
+                params["extra_headers"] = self._tools_headers
+            self._tools_params = (tools, params)
+        return self._tools_params[1]
+
+    def _tool_loop(
+        self,
+        query: str,
+        conversation_history: str | None,
+        tools: list | None,
+        tool_manager,
+    ) -> Generator[dict[str, Any] | list, Any, str]:
+        """
+        Drive the tool-calling loop without performing any I/O itself.
+
+        Yields either the parameters for a Claude API call (a dict) or the
+        tool_use blocks to execute (a list). The caller performs the work and
+        sends back the response or the tool results in block order (or throws
+        the raised exception in). Keeping the loop free of I/O lets the sync
+        and async entry points share it. Returns the final response text.
+        """
+
+        # 1. Build system content
+        system_content = self._build_system(conversation_history)
 
         # 2. Initialize messages array
         messages = [{"role": "user", "content": query}]
 
-        # 3. Prepare base API parameters
-        base_api_params = {**self.base_params, "system": system_content}
+        # 3. Prepare API parameters; messages is passed by reference and grows
+        # in place, so the same dict is reused for every round
+        base_api_params = {
+            **self.base_params,
+            "system": system_content,
+            "messages": messages,
+        }
 
         # 4. Add tools if available
         if tools:
-            base_api_params["tools"] = tools
-            base_api_params["tool_choice"] = {"type": "auto"}
+            base_api_params.update(self._get_tools_params(tools))
 
         # 5. ITERATIVE LOOP for sequential tool calling
         current_response = None
+        needs_final_call = False
+        seen_rounds: set[tuple] = set()
         for round_num in range(self.max_tool_rounds):
-            logger.debug(f"Tool round {round_num + 1}/{self.max_tool_rounds}")
+            logger.debug("Tool round %d/%d", round_num + 1, self.max_tool_rounds)
 
-            # 5a. Make API call with current messages (pass a copy to avoid mutation issues)
+            # 5a. Make API call with current messages
             try:
-                api_params = {**base_api_params, "messages": list(messages)}
-                logger.debug(f"Making Claude API call with {len(messages)} message(s)")
-                current_response = self.client.messages.create(**api_params)
-                logger.debug(f"Response stop_reason: {current_response.stop_reason}")
+                logger.debug("Making Claude API call with %d message(s)", len(messages))
+                current_response = yield base_api_params
+                logger.debug("Response stop_reason: %s", current_response.stop_reason)
             except Exception as e:
-                logger.error(f"Claude API error in round {round_num + 1}: {e}")
+                logger.error("Claude API error in round %d: %s", round_num + 1, e)
                 if round_num == 0:
                     raise  # First call failed - propagate error
                 else:
-                    return "I encountered an error while processing your request."
-
-            # 5b. TERMINATION CHECK: No tool use requested
-            if current_response.stop_reason != "tool_use":
+                    return self.TOOL_ROUND_ERROR_RESPONSE
+
+            # 5b. Single pass over the content: tool_use blocks and the first text block
+            tool_blocks = []
+            text_block = None
+            for block in current_response.content or ():
+                block_type = getattr(block, "type", None)
+                if block_type == "tool_use":
+                    tool_blocks.append(block)
+                elif block_type == "text" and text_block is None:
+                    text_block = block
+
+            # 5c. TERMINATION CHECK: No tool use requested - answer directly
+            if current_response.stop_reason != "tool_use" or not tool_blocks:
                 logger.debug("Claude provided final answer without requesting tools")
+                if text_block is not None:
+                    return text_block.text
                 break
 
-            # 5c. TERMINATION CHECK: No tool manager available
+            # 5d. TERMINATION CHECK: No tool manager available
             if not tool_manager:
                 logger.warning("Tools requested but no tool_manager available")
                 break
 
-            # 5d. Execute all requested tools
+            # 5e. Execute all requested tools (the caller may run them concurrently)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Executing tools: %s", [b.name for b in tool_blocks])
+            tool_outputs = yield tool_blocks
+
             tool_results = []
             all_tools_failed = True
 
-            for content_block in current_response.content:
-                if content_block.type == "tool_use":
-                    logger.debug(f"Executing tool: {content_block.name}")
-                    tool_result = tool_manager.execute_tool(
-                        content_block.name, **content_block.input
-                    )
-                    logger.debug(
-                        f"Tool result length: {len(tool_result) if tool_result else 0} characters"
-                    )
-
-                    tool_results.append(
-                        {
-                            "type": "tool_result",
-                            "tool_use_id": content_block.id,
-                            "content": tool_result,
-                        }
-                    )
-
-                    # Check if tool returned "no results" (should terminate)
-                    # Errors should be passed to Claude for explanation (don't terminate)
-                    is_no_results = tool_result and (
-                        "no " in tool_result.lower()[:10]
-                        or "not found" in tool_result.lower()
-                    )
-                    if not is_no_results:
-                        all_tools_failed = False
-
-            # 5e. TERMINATION CHECK: All tools failed
-            if all_tools_failed and tool_results:
-                logger.error("All tools failed - terminating loop")
-                break
+            for content_block, tool_result in zip(
+                tool_blocks, tool_outputs, strict=True
+            ):
+                logger.debug(
+                    "Tool result length: %d characters",
+                    len(tool_result) if tool_result else 0,
+                )
+
+                tool_results.append(
+                    {
+                        "type": "tool_result",
+                        "tool_use_id": content_block.id,
+                        "content": tool_result,
+                    }
+                )
 
-            # 5f. Append messages for next iteration
-            messages.append({"role": "assistant", "content": current_response.content})
+                # Check if tool returned "no results" (should terminate)
+                # Errors should be passed to Claude for explanation (don't terminate)
+                is_no_results = (
+                    bool(tool_result)
+                    and len(tool_result) <= _NO_RESULTS_MAX_LENGTH
+                    and _NO_RESULTS_RE.search(tool_result) is not None
+                )
+                if not is_no_results:
+                    all_tools_failed = False
+
+            # 5f. Append messages for the next call (tool_results is never empty
+            # here: every tool_use block produced a result)
+            messages.extend(
+                (
+                    {"role": "assistant", "content": current_response.content},
+                    {"role": "user", "content": tool_results},
+                )
+            )
 
-            if tool_results:
-                messages.append({"role": "user", "content": tool_results})
+            if self.tool_result_rounds_kept:
+                self._compact_messages(messages, self.tool_result_rounds_kept)
 
             logger.debug(
-                f"Round {round_num + 1} complete. Total messages: {len(messages)}"
+                "Round %d complete. Total messages: %d", round_num + 1, len(messages)
             )
+
+            # 5g. TERMINATION CHECK: All tools found nothing; more rounds won't
+            # help, so Claude answers from what it has
+            if all_tools_failed:
+                logger.warning("All tools returned no results - requesting answer")
+                needs_final_call = True
+                break
+
+            # 5h. TERMINATION CHECK: Claude repeated an earlier round's calls and
+            # got the same results, so another round adds no information
+            round_calls = tuple(
+                (block.name, json.dumps(block.input, sort_keys=True), result)
+                for block, result in zip(tool_blocks, tool_outputs, strict=True)
+            )
+            if round_calls in seen_rounds:
+                logger.warning("Tool round repeated an earlier one - requesting answer")
+                needs_final_call = True
+                break
+            seen_rounds.add(round_calls)
         else:
-            # 6. Handle max rounds exceeded (only if loop completed without break)
+            # 6. Max rounds exceeded (only if loop completed without break)
             if current_response and current_response.stop_reason == "tool_use":
                 logger.warning(
-                    f"Max tool rounds ({self.max_tool_rounds}) reached. Making final call without tools."
+                    "Max tool rounds (%d) reached - requesting answer",
+                    self.max_tool_rounds,
                 )
-                # Make final call WITHOUT tools to force text response
-                final_params = {
-                    **self.base_params,
-                    "messages": messages,
-                    "system": system_content,
-                }
+                needs_final_call = True
 
-                try:
-                    current_response = self.client.messages.create(**final_params)
-                except Exception as e:
-                    logger.error(f"Final API call failed: {e}")
-                    return "I gathered information but encountered an error generating the final response."
+        if needs_final_call:
+            # Final call forbids tools to force a text response, but still
+            # sends them: tools and system form the cached prompt prefix,
+            # which dropping the tools would invalidate
+            final_params = {**base_api_params, "tool_choice": {"type": "none"}}
+
+            try:
+                current_response = yield final_params
+            except Exception as e:
+                logger.error("Final API call failed: %s", e)
+                return self.FINAL_CALL_ERROR_RESPONSE
 
         # 7. Extract and return final text
-        if not current_response or not current_response.content:
+        return self._extract_text(current_response)
+
+    @staticmethod
+    def _compact_messages(messages: list[dict[str, Any]], keep_last_n: int):
+        """
+        Elide the tool results of the round that just fell out of the last
+        keep_last_n rounds; called once after each round is appended.
+
+        Each result keeps its tool_use_id, so every tool_use still has its
+        tool_result. The message is replaced rather than mutated because
+        earlier requests may still reference it.
+        """
+        result_indexes = [
+            index
+            for index, message in enumerate(messages)
+            if message["role"] == "user" and isinstance(message["content"], list)
+        ]
+        if len(result_indexes) <= keep_last_n:
+            return
+        index = result_indexes[-keep_last_n - 1]
+        messages[index] = {
+            "role": "user",
+            "content": [
+                {**block, "content": f"[elided {len(block['content'] or '')} chars]"}
+                for block in messages[index]["content"]
+            ],
+        }
+
+    def _build_system(self, conversation_history: str | None) -> list[dict[str, Any]]:
+        """Build system blocks; history goes after the cached static block"""
+        if not conversation_history:
+            return self._system_blocks
+        return self._system_blocks + [
+            {"type": "text", "text": f"Previous conversation:\n{conversation_history}"}
+        ]
+
+    def _extract_text(self, response) -> str:
+        """Return the text of a final response, or a fallback reply"""
+        if not response or not response.content:
             logger.error("No response content received")
-            return "I apologize, but I couldn't generate a response."
+            return self.EMPTY_RESPONSE
 
-        # Find text content block
-        for content_block in current_response.content:
-            if hasattr(content_block, "text"):
-                return content_block.text
+        # Find text content block; after end_turn it is almost always the first
+        blocks = response.content
+        if getattr(blocks[0], "type", None) == "text":
+            return blocks[0].text
 
-        # Fallback if no text block found
-        logger.warning("No text content in final response")
-        return "I couldn't generate a proper response."
+        text = next(
+            (block.text for block in blocks if getattr(block, "type", None) == "text"),
+            None,
+        )
+        if text is None:
+            # Fallback if no text block found
+            logger.warning("No text content in final response")
+            return self.NO_TEXT_RESPONSE
+        return text
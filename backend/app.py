@@ -2,16 +2,18 @@ import warnings
 
 warnings.filterwarnings("ignore", message="resource_tracker: There appear to be.*")
 
+import json  # noqa: E402
 import os  # noqa: E402
 
-from config import config  # noqa: E402
 from fastapi import FastAPI, HTTPException  # noqa: E402
 from fastapi.middleware.cors import CORSMiddleware  # noqa: E402
 from fastapi.middleware.trustedhost import TrustedHostMiddleware  # noqa: E402
-from fastapi.responses import FileResponse  # noqa: E402
+from fastapi.responses import FileResponse, StreamingResponse  # noqa: E402
 from fastapi.staticfiles import StaticFiles  # noqa: E402
-from models import Source  # noqa: E402
 from pydantic import BaseModel  # noqa: E402
+
+from config import config  # noqa: E402
+from models import Source  # noqa: E402
 from rag_system import RAGSystem  # noqa: E402
 
 # Initialize FastAPI app
@@ -69,14 +71,34 @@ async def query_documents(request: QueryRequest):
         if not session_id:
             session_id = rag_system.session_manager.create_session()
 
-        # Process query using RAG system
-        answer, sources = rag_system.query(request.query, session_id)
+        # Process query using RAG system (awaited so concurrent requests overlap)
+        answer, sources = await rag_system.aquery(request.query, session_id)
 
         return QueryResponse(answer=answer, sources=sources, session_id=session_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
+@app.post("/api/query/stream")
+async def stream_query(request: QueryRequest):
+    """Process a query and stream the answer as server-sent events"""
+    # Create session if not provided
+    session_id = request.session_id
+    if not session_id:
+        session_id = rag_system.session_manager.create_session()
+
+    async def events():
+        yield f"data: {json.dumps({'type': 'session', 'session_id': session_id})}\n\n"
+        try:
+            async for event in rag_system.aquery_stream(request.query, session_id):
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            # Headers are already sent, so report failures in-band
+            yield f"data: {json.dumps({'type': 'error', 'detail': str(e)})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @app.get("/api/courses", response_model=CourseStats)
 async def get_course_stats():
     """Get course analytics and statistics"""
@@ -92,7 +114,7 @@ async def get_course_stats():
 
 @app.on_event("startup")
 async def startup_event():
-    """Load initial documents on startup"""
+    """Load initial documents and warm up models on startup"""
     docs_path = "../docs"
     if os.path.exists(docs_path):
         print("Loading initial documents...")
@@ -104,6 +126,15 @@ async def startup_event():
         except Exception as e:
             print(f"Error loading documents: {e}")
 
+    # Pay model load and connection setup now rather than on the first query
+    await rag_system.warmup()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled connections to the Anthropic API"""
+    await rag_system.ai_generator.aclose()
+
 
 # Custom static file handler with no-cache headers for development
 
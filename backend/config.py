@@ -7,9 +7,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Config:
-    """Configuration settings for the RAG system"""
+    """Configuration settings for the RAG system (immutable once validated)"""
 
     # Anthropic API settings
     ANTHROPIC_API_KEY: str = os.getenv("ANTHROPIC_API_KEY", "")
@@ -24,6 +24,16 @@ class Config:
     MAX_RESULTS: int = 5  # Maximum search results to return
     MAX_HISTORY: int = 2  # Number of conversation messages to remember
     MAX_TOOL_ROUNDS: int = 2  # Maximum sequential tool execution rounds per query
+    MAX_CONCURRENT_API_CALLS: int = 32  # In-flight Claude calls from the async path
+    TOKEN_EFFICIENT_TOOLS: bool = False  # Tool-use beta header (Claude 3.7 Sonnet)
+    TOOL_RESULT_ROUNDS_KEPT: int = 0  # Older tool results elided (0 keeps all)
+
+    # Response cache settings
+    RESPONSE_CACHE_ENABLED: bool = True  # Reuse answers for similar queries
+    RESPONSE_CACHE_SIZE: int = 1024  # Maximum number of cached answers
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92  # Minimum cosine similarity for a cache hit
+    SEMANTIC_CACHE_CONTEXT_THRESHOLD: float = 0.85  # Minimum history similarity
+    API_CACHE_SIZE: int = 256  # Identical Claude requests reused (0 disables)
 
     # Database paths
     CHROMA_PATH: str = "./chroma_db"  # ChromaDB storage location
@@ -52,6 +62,30 @@ class Config:
             raise ValueError(
                 f"MAX_TOOL_ROUNDS exceeds maximum of 5, got {self.MAX_TOOL_ROUNDS}"
             )
+        if self.TOOL_RESULT_ROUNDS_KEPT < 0:
+            raise ValueError(
+                f"TOOL_RESULT_ROUNDS_KEPT cannot be negative, got {self.TOOL_RESULT_ROUNDS_KEPT}"
+            )
+        if self.MAX_CONCURRENT_API_CALLS <= 0:
+            raise ValueError(
+                f"MAX_CONCURRENT_API_CALLS must be positive, got {self.MAX_CONCURRENT_API_CALLS}"
+            )
+        if self.RESPONSE_CACHE_SIZE <= 0:
+            raise ValueError(
+                f"RESPONSE_CACHE_SIZE must be positive, got {self.RESPONSE_CACHE_SIZE}"
+            )
+        if self.API_CACHE_SIZE < 0:
+            raise ValueError(
+                f"API_CACHE_SIZE cannot be negative, got {self.API_CACHE_SIZE}"
+            )
+        if not 0 < self.SEMANTIC_CACHE_THRESHOLD <= 1:
+            raise ValueError(
+                f"SEMANTIC_CACHE_THRESHOLD must be in (0, 1], got {self.SEMANTIC_CACHE_THRESHOLD}"
+            )
+        if not 0 < self.SEMANTIC_CACHE_CONTEXT_THRESHOLD <= 1:
+            raise ValueError(
+                f"SEMANTIC_CACHE_CONTEXT_THRESHOLD must be in (0, 1], got {self.SEMANTIC_CACHE_CONTEXT_THRESHOLD}"
+            )
 
 
 config = Config()
@@ -1,8 +1,12 @@
+import asyncio
 import os
+from collections.abc import AsyncIterator
+from typing import Any
 
 from ai_generator import AIGenerator
 from document_processor import DocumentProcessor
 from models import Course, Source
+from response_cache import CachedResponse, SemanticCache
 from search_tools import CourseOutlineTool, CourseSearchTool, ToolManager
 from session_manager import SessionManager
 from vector_store import VectorStore
@@ -22,10 +26,31 @@ class RAGSystem:
             config.CHROMA_PATH, config.EMBEDDING_MODEL, config.MAX_RESULTS
         )
         self.ai_generator = AIGenerator(
-            config.ANTHROPIC_API_KEY, config.ANTHROPIC_MODEL, config.MAX_TOOL_ROUNDS
+            config.ANTHROPIC_API_KEY,
+            config.ANTHROPIC_MODEL,
+            config.MAX_TOOL_ROUNDS,
+            config.MAX_CONCURRENT_API_CALLS,
+            config.API_CACHE_SIZE,
+            config.TOKEN_EFFICIENT_TOOLS,
+            config.TOOL_RESULT_ROUNDS_KEPT,
         )
         self.session_manager = SessionManager(config.MAX_HISTORY)
 
+        # Reuse answers for semantically similar questions, sharing the vector
+        # store's embedding model rather than loading a second copy
+        self.response_cache = None
+        if config.RESPONSE_CACHE_ENABLED:
+            self.response_cache = SemanticCache(
+                self.vector_store.embedding_function,
+                threshold=config.SEMANTIC_CACHE_THRESHOLD,
+                context_threshold=config.SEMANTIC_CACHE_CONTEXT_THRESHOLD,
+                max_entries=config.RESPONSE_CACHE_SIZE,
+            )
+
+        # Generations in progress on the async path, keyed by (query, history),
+        # so identical concurrent questions share one set of API calls
+        self._inflight: dict[tuple[str, str | None], asyncio.Task] = {}
+
         # Initialize search tools
         self.tool_manager = ToolManager()
         self.search_tool = CourseSearchTool(self.vector_store)
@@ -33,6 +58,13 @@ class RAGSystem:
         self.tool_manager.register_tool(self.search_tool)
         self.tool_manager.register_tool(self.outline_tool)
 
+    def _create_tool_manager(self) -> ToolManager:
+        """Build a ToolManager whose tools track sources for a single request"""
+        tool_manager = ToolManager()
+        tool_manager.register_tool(CourseSearchTool(self.vector_store))
+        tool_manager.register_tool(CourseOutlineTool(self.vector_store))
+        return tool_manager
+
     def add_course_document(self, file_path: str) -> tuple[Course, int]:
         """
         Add a single course document to the knowledge base.
@@ -55,6 +87,9 @@ class RAGSystem:
             # Add course content chunks to vector store
             self.vector_store.add_course_content(course_chunks)
 
+            # Cached answers may no longer reflect the catalog
+            self._clear_response_cache()
+
             return course, len(course_chunks)
         except Exception as e:
             print(f"Error processing course document {file_path}: {e}")
@@ -116,8 +151,16 @@ class RAGSystem:
                 except Exception as e:
                     print(f"Error processing {file_name}: {e}")
 
+        if clear_existing or total_courses:
+            self._clear_response_cache()
+
         return total_courses, total_chunks
 
+    def _clear_response_cache(self):
+        """Invalidate cached answers after the knowledge base changes"""
+        if self.response_cache is not None:
+            self.response_cache.clear()
+
     def query(
         self, query: str, session_id: str | None = None
     ) -> tuple[str, list[Source]]:
@@ -139,26 +182,198 @@ class RAGSystem:
         if session_id:
             history = self.session_manager.get_conversation_history(session_id)
 
-        # Generate response using AI with tools
-        response = self.ai_generator.generate_response(
+        # Serve semantically similar repeats from the cache (keyed on the raw
+        # question, since the shared prompt prefix would inflate similarity)
+        cached = self._get_cached_response(query, history)
+
+        if cached is not None:
+            response, sources = cached.answer, list(cached.sources)
+        else:
+            # Generate response using AI with tools
+            response = self.ai_generator.generate_response(
+                query=prompt,
+                conversation_history=history,
+                tools=self.tool_manager.get_tool_definitions(),
+                tool_manager=self.tool_manager,
+            )
+
+            # Get sources from the search tool
+            sources = self.tool_manager.get_last_sources()
+
+            # Reset sources after retrieving them
+            self.tool_manager.reset_sources()
+
+            self._cache_response(query, history, response, sources)
+
+        # Update conversation history
+        if session_id:
+            self.session_manager.add_exchange(session_id, query, response)
+
+        # Return response with sources from tool searches
+        return response, sources
+
+    async def aquery(
+        self, query: str, session_id: str | None = None
+    ) -> tuple[str, list[Source]]:
+        """
+        Async variant of query used by the API server.
+
+        Each call gets its own ToolManager, so concurrent requests cannot read
+        or reset each other's sources while their API calls are in flight.
+        Identical questions asked while one is already generating wait for
+        that answer instead of calling Claude again.
+
+        Args:
+            query: User's question
+            session_id: Optional session ID for conversation context
+
+        Returns:
+            Tuple of (response, sources list with links)
+        """
+        prompt = f"""Answer this question about course materials: {query}"""
+
+        history = None
+        if session_id:
+            history = self.session_manager.get_conversation_history(session_id)
+
+        cached = await self._aget_cached_response(query, history)
+
+        if cached is not None:
+            response, sources = cached.answer, list(cached.sources)
+        else:
+            key = (query, history)
+            task = self._inflight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._agenerate(query, prompt, history))
+                self._inflight[key] = task
+                task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+            # Shielded so one caller disconnecting doesn't cancel the others
+            response, sources = await asyncio.shield(task)
+            sources = list(sources)
+
+        if session_id:
+            self.session_manager.add_exchange(session_id, query, response)
+
+        return response, sources
+
+    async def _agenerate(
+        self, query: str, prompt: str, history: str | None
+    ) -> tuple[str, list[Source]]:
+        """Generate and cache an answer using a ToolManager private to this request"""
+        tool_manager = self._create_tool_manager()
+        response = await self.ai_generator.agenerate_response(
             query=prompt,
             conversation_history=history,
+            # Definitions are identical across managers; reuse the shared list
             tools=self.tool_manager.get_tool_definitions(),
-            tool_manager=self.tool_manager,
+            tool_manager=tool_manager,
         )
+        sources = tool_manager.get_last_sources()
 
-        # Get sources from the search tool
-        sources = self.tool_manager.get_last_sources()
+        await self._acache_response(query, history, response, sources)
+        return response, sources
 
-        # Reset sources after retrieving them
-        self.tool_manager.reset_sources()
+    async def aquery_stream(
+        self, query: str, session_id: str | None = None
+    ) -> AsyncIterator[dict[str, Any]]:
+        """
+        Streaming variant of aquery for the server-sent events endpoint.
+
+        Yields {"type": "text", "text": ...} events as the answer is generated,
+        {"type": "interim"} events when the text so far was not part of the
+        answer (see AIGenerator.astream_response), then one
+        {"type": "sources", "sources": [...]} event. History and the response
+        cache are updated with the final answer once it is known; fallback
+        replies are never cached.
+
+        Args:
+            query: User's question
+            session_id: Optional session ID for conversation context
+        """
+        prompt = f"""Answer this question about course materials: {query}"""
+
+        history = None
+        if session_id:
+            history = self.session_manager.get_conversation_history(session_id)
+
+        cached = await self._aget_cached_response(query, history)
+
+        if cached is not None:
+            response, sources = cached.answer, list(cached.sources)
+            yield {"type": "text", "text": response}
+        else:
+            tool_manager = self._create_tool_manager()
+            async for event in self.ai_generator.astream_response(
+                query=prompt,
+                conversation_history=history,
+                tools=self.tool_manager.get_tool_definitions(),
+                tool_manager=tool_manager,
+            ):
+                if event["type"] == "answer":
+                    answer = event
+                else:
+                    yield event
+            response = answer["text"]
+            sources = tool_manager.get_last_sources()
+
+            if not answer["fallback"]:
+                await self._acache_response(query, history, response, sources)
 
-        # Update conversation history
         if session_id:
             self.session_manager.add_exchange(session_id, query, response)
 
-        # Return response with sources from tool searches
-        return response, sources
+        yield {
+            "type": "sources",
+            "sources": [source.model_dump() for source in sources],
+        }
+
+    def _get_cached_response(
+        self, query: str, history: str | None
+    ) -> CachedResponse | None:
+        """Look up a cached answer if the response cache is enabled"""
+        if self.response_cache is None:
+            return None
+        return self.response_cache.get(query, history)
+
+    def _cache_response(
+        self, query: str, history: str | None, response: str, sources: list[Source]
+    ):
+        """Cache a generated answer unless it is a canned failure reply"""
+        if (
+            self.response_cache is not None
+            and response not in AIGenerator.FALLBACK_RESPONSES
+        ):
+            self.response_cache.put(query, history, response, sources)
+
+    async def _aget_cached_response(
+        self, query: str, history: str | None
+    ) -> CachedResponse | None:
+        """Async _get_cached_response; embeddings run off the event loop"""
+        if self.response_cache is None:
+            return None
+        return await self.response_cache.aget(query, history)
+
+    async def _acache_response(
+        self, query: str, history: str | None, response: str, sources: list[Source]
+    ):
+        """Async _cache_response; embeddings run off the event loop"""
+        if (
+            self.response_cache is not None
+            and response not in AIGenerator.FALLBACK_RESPONSES
+        ):
+            await self.response_cache.aput(query, history, response, sources)
+
+    async def warmup(self):
+        """Load the embedding model and open API connections ahead of traffic"""
+        await asyncio.gather(self.ai_generator.warmup(), self._warm_embeddings())
+
+    async def _warm_embeddings(self):
+        """Run one embedding so model weights and kernels are ready for queries"""
+        try:
+            await asyncio.to_thread(self.vector_store.embedding_function, ["warmup"])
+        except Exception as e:
+            print(f"Embedding model warmup failed: {e}")
 
     def get_course_analytics(self) -> dict:
         """Get analytics about the course catalog"""
@@ -0,0 +1,263 @@
+import asyncio
+import hashlib
+import re
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+from models import Source
+
+# Personal data that must never be served to another user from the cache
+_PII_RE = re.compile(
+    r"[\w.+-]+@[\w-]+\.[\w.-]+"  # email address
+    r"|\b\d{3}-\d{2}-\d{4}\b"  # US social security number
+    r"|(?<!\w)\+?(?:\d[ ().-]{0,2}){9,14}\d\b"  # phone number
+    r"|\b(?:sk|pk|api|key|token)[-_][A-Za-z0-9_-]{16,}"  # API key or token
+)
+
+
+def contains_pii(text: str) -> bool:
+    """Check text for emails, phone numbers, SSNs or API keys"""
+    return _PII_RE.search(text) is not None
+
+
+@dataclass
+class CachedResponse:
+    """A generated answer stored in the response cache"""
+
+    answer: str  # The generated response text
+    sources: list[Source]  # Sources that were returned alongside the answer
+
+
+class SemanticCache:
+    """
+    In-memory cache of generated answers with two lookup tiers:
+
+    1. Exact match on a hash of (query, conversation history) - a dict lookup
+    2. Semantic match: the query embeddings must be similar and so must the
+       conversation contexts, so a follow-up is never answered for another topic
+
+    Answers containing personal data are never stored.
+    """
+
+    def __init__(
+        self,
+        embedding_function: Callable[[list[str]], Sequence],
+        threshold: float = 0.92,
+        context_threshold: float = 0.85,
+        max_entries: int = 1024,
+        top_k: int = 5,
+    ):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"threshold must be in (0, 1], got {threshold}")
+        if not 0 < context_threshold <= 1:
+            raise ValueError(
+                f"context_threshold must be in (0, 1], got {context_threshold}"
+            )
+        if max_entries <= 0:
+            raise ValueError(f"max_entries must be positive, got {max_entries}")
+
+        self.embedding_function = embedding_function
+        self.threshold = threshold
+        self.context_threshold = context_threshold
+        self.max_entries = max_entries
+        self.top_k = top_k
+
+        # Exact-match tier, least recently used first
+        self._exact: OrderedDict[bytes, CachedResponse] = OrderedDict()
+
+        # Semantic tier: normalized query embeddings are rows of one contiguous
+        # matrix, so a lookup is a single matrix-vector product. Rows and the
+        # parallel slot lists form a ring buffer once max_entries is reached;
+        # _next_slot is then the oldest entry, overwritten by the next put().
+        self._matrix: np.ndarray | None = None
+        self._size = 0
+        self._next_slot = 0
+        self._context_embeddings: list[np.ndarray | None] = []
+        self._responses: list[CachedResponse] = []
+
+        # Memoize embeddings so a miss followed by put() only encodes once
+        self._embed = lru_cache(maxsize=256)(self._encode)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _encode(self, text: str) -> np.ndarray:
+        """Embed text and L2-normalize it so dot products are cosine similarities"""
+        vector = np.asarray(self.embedding_function([text])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _exact_key(query: str, conversation_history: str | None) -> bytes:
+        """Hash the literal query and history for the exact-match tier"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(query.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update((conversation_history or "").encode("utf-8"))
+        return digest.digest()
+
+    def _context_embedding(self, conversation_history: str | None) -> np.ndarray | None:
+        """Embed the whitespace-normalized history, or None without history"""
+        normalized = " ".join((conversation_history or "").split())
+        return self._embed(normalized) if normalized else None
+
+    def _context_matches(
+        self, cached: np.ndarray | None, current: np.ndarray | None
+    ) -> bool:
+        """Check that two conversation contexts are similar enough to share answers"""
+        if cached is None or current is None:
+            return cached is current
+        return float(cached @ current) >= self.context_threshold
+
+    def _embed_pair(
+        self, query: str, conversation_history: str | None
+    ) -> tuple[np.ndarray, np.ndarray | None]:
+        """Embed the query and the conversation context (the slow part)"""
+        return self._embed(query), self._context_embedding(conversation_history)
+
+    def _get_exact(
+        self, query: str, conversation_history: str | None
+    ) -> CachedResponse | None:
+        """Exact-match tier lookup; no embedding needed"""
+        exact_key = self._exact_key(query, conversation_history)
+        cached = self._exact.get(exact_key)
+        if cached is not None:
+            self._exact.move_to_end(exact_key)
+        return cached
+
+    def _get_similar(
+        self, query_vector: np.ndarray, context_vector: np.ndarray | None
+    ) -> CachedResponse | None:
+        """Semantic tier lookup with precomputed embeddings"""
+        if not self._size:
+            return None
+
+        similarities = self._matrix[: self._size] @ query_vector
+        candidates = np.flatnonzero(similarities >= self.threshold)
+        if len(candidates) > self.top_k:
+            top = np.argpartition(-similarities[candidates], self.top_k - 1)
+            candidates = candidates[top[: self.top_k]]
+        for index in candidates[np.argsort(-similarities[candidates])]:
+            if self._context_matches(self._context_embeddings[index], context_vector):
+                return self._responses[index]
+
+        return None
+
+    def get(
+        self, query: str, conversation_history: str | None = None
+    ) -> CachedResponse | None:
+        """
+        Look up a cached answer for an identical or semantically similar query.
+
+        Args:
+            query: The user's question
+            conversation_history: Formatted conversation history, if any
+
+        Returns:
+            The cached response, or None on a miss
+        """
+        cached = self._get_exact(query, conversation_history)
+        if cached is not None or not self._size:
+            return cached
+        return self._get_similar(*self._embed_pair(query, conversation_history))
+
+    async def aget(
+        self, query: str, conversation_history: str | None = None
+    ) -> CachedResponse | None:
+        """
+        Async variant of get for the API server.
+
+        Embeddings are computed in a worker thread so other requests keep
+        running; the index itself is only read on the event loop.
+        """
+        cached = self._get_exact(query, conversation_history)
+        if cached is not None or not self._size:
+            return cached
+        vectors = await asyncio.to_thread(self._embed_pair, query, conversation_history)
+        return self._get_similar(*vectors)
+
+    def put(
+        self,
+        query: str,
+        conversation_history: str | None,
+        answer: str,
+        sources: list[Source],
+    ):
+        """Store a generated answer, evicting the oldest entries when full"""
+        if contains_pii(answer):
+            return
+        self._insert(
+            query,
+            conversation_history,
+            CachedResponse(answer=answer, sources=list(sources)),
+            *self._embed_pair(query, conversation_history),
+        )
+
+    async def aput(
+        self,
+        query: str,
+        conversation_history: str | None,
+        answer: str,
+        sources: list[Source],
+    ):
+        """Async variant of put; embeds in a worker thread, inserts on the loop"""
+        if contains_pii(answer):
+            return
+        vectors = await asyncio.to_thread(self._embed_pair, query, conversation_history)
+        self._insert(
+            query,
+            conversation_history,
+            CachedResponse(answer=answer, sources=list(sources)),
+            *vectors,
+        )
+
+    def _insert(
+        self,
+        query: str,
+        conversation_history: str | None,
+        cached: CachedResponse,
+        query_vector: np.ndarray,
+        context_vector: np.ndarray | None,
+    ):
+        """Add an entry to both tiers with precomputed embeddings"""
+        self._exact[self._exact_key(query, conversation_history)] = cached
+        if len(self._exact) > self.max_entries:
+            self._exact.popitem(last=False)
+
+        if self._size < self.max_entries:
+            slot = self._size
+            self._reserve(slot + 1, len(query_vector))
+            self._context_embeddings.append(context_vector)
+            self._responses.append(cached)
+            self._size += 1
+        else:
+            slot = self._next_slot
+            self._next_slot = (slot + 1) % self.max_entries
+            self._context_embeddings[slot] = context_vector
+            self._responses[slot] = cached
+
+        self._matrix[slot] = query_vector
+
+    def _reserve(self, rows: int, dim: int):
+        """Grow the embedding matrix by doubling so inserts are amortized O(1)"""
+        capacity = 0 if self._matrix is None else len(self._matrix)
+        if rows <= capacity:
+            return
+        capacity = min(max(capacity * 2, 16), self.max_entries)
+        matrix = np.empty((capacity, dim), dtype=np.float32)
+        if self._size:
+            matrix[: self._size] = self._matrix[: self._size]
+        self._matrix = matrix
+
+    def clear(self):
+        """Drop all cached answers (e.g. after the course catalog changes)"""
+        self._exact.clear()
+        self._matrix = None
+        self._size = 0
+        self._next_slot = 0
+        self._context_embeddings.clear()
+        self._responses.clear()
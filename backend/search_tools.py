@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing import Any
 
@@ -18,6 +19,10 @@ class Tool(ABC):
         """Execute the tool with given parameters"""
         pass
 
+    def execute_with_sources(self, **kwargs) -> tuple[str, list[Source]]:
+        """Execute the tool, also returning the sources this call found"""
+        return self.execute(**kwargs), []
+
 
 class CourseSearchTool(Tool):
     """Tool for searching course content with semantic course name matching"""
@@ -68,6 +73,21 @@ class CourseSearchTool(Tool):
         Returns:
             Formatted search results or error message
         """
+        result, sources = self.execute_with_sources(query, course_name, lesson_number)
+        if sources:
+            self.last_sources = sources
+        return result
+
+    def execute_with_sources(
+        self,
+        query: str,
+        course_name: str | None = None,
+        lesson_number: int | None = None,
+    ) -> tuple[str, list[Source]]:
+        """
+        Execute the search, returning its sources instead of storing them, so
+        concurrent searches on this tool cannot overwrite each other's
+        """
 
         # Use the vector store's unified search interface
         results = self.store.search(
@@ -76,7 +96,7 @@ class CourseSearchTool(Tool):
 
         # Handle errors
         if results.error:
-            return results.error
+            return results.error, []
 
         # Handle empty results
         if results.is_empty():
@@ -85,12 +105,12 @@ class CourseSearchTool(Tool):
                 filter_info += f" in course '{course_name}'"
             if lesson_number:
                 filter_info += f" in lesson {lesson_number}"
-            return f"No relevant content found{filter_info}."
+            return f"No relevant content found{filter_info}.", []
 
         # Format and return results
         return self._format_results(results)
 
-    def _format_results(self, results: SearchResults) -> str:
+    def _format_results(self, results: SearchResults) -> tuple[str, list[Source]]:
         """Format search results with course and lesson context"""
         formatted = []
         sources: list[Source] = []  # Track sources for the UI
@@ -126,10 +146,7 @@ class CourseSearchTool(Tool):
 
             formatted.append(f"{header}\n{doc}")
 
-        # Store sources for retrieval
-        self.last_sources = sources
-
-        return "\n\n".join(formatted)
+        return "\n\n".join(formatted), sources
 
 
 class CourseOutlineTool(Tool):
@@ -227,6 +244,8 @@ class ToolManager:
 
     def __init__(self):
         self.tools = {}
+        self._tool_definitions: list | None = None  # Built lazily, reset on register
+        self.last_sources: list[Source] = []  # Sources of the last round that found any
 
     def register_tool(self, tool: Tool):
         """Register any tool that implements the Tool interface"""
@@ -235,28 +254,66 @@ class ToolManager:
         if not tool_name:
             raise ValueError("Tool must have a 'name' in its definition")
         self.tools[tool_name] = tool
+        self._tool_definitions = None
 
     def get_tool_definitions(self) -> list:
-        """Get all tool definitions for Anthropic tool calling"""
-        return [tool.get_tool_definition() for tool in self.tools.values()]
+        """Get all tool definitions for Anthropic tool calling (cached list)"""
+        if self._tool_definitions is None:
+            self._tool_definitions = [
+                tool.get_tool_definition() for tool in self.tools.values()
+            ]
+        return self._tool_definitions
 
     def execute_tool(self, tool_name: str, **kwargs) -> str:
         """Execute a tool by name with given parameters"""
+        result, sources = self.execute_tool_with_sources(tool_name, **kwargs)
+        self.record_sources([sources])
+        return result
+
+    def execute_tool_with_sources(
+        self, tool_name: str, **kwargs
+    ) -> tuple[str, list[Source]]:
+        """
+        Execute a tool by name, returning its sources instead of recording them.
+
+        Safe to run several at once in threads; pass each call's sources to
+        record_sources in call order once they have all finished.
+        """
         if tool_name not in self.tools:
-            return f"Tool '{tool_name}' not found"
+            return f"Tool '{tool_name}' not found", []
+
+        return self.tools[tool_name].execute_with_sources(**kwargs)
+
+    async def aexecute_tool_with_sources(
+        self, tool_name: str, **kwargs
+    ) -> tuple[str, list[Source]]:
+        """Run execute_tool_with_sources in a worker thread so several can overlap"""
+        return await asyncio.to_thread(
+            self.execute_tool_with_sources, tool_name, **kwargs
+        )
 
-        return self.tools[tool_name].execute(**kwargs)
+    def record_sources(self, call_sources: list[list[Source]]):
+        """
+        Keep the sources of one round of tool calls, merged in call order.
+
+        A round that found none keeps the previous round's sources, as a
+        search with no results always has.
+        """
+        merged: list[Source] = []
+        for sources in call_sources:
+            for source in sources:
+                if source not in merged:
+                    merged.append(source)
+        if merged:
+            self.last_sources = merged
 
     def get_last_sources(self) -> list:
-        """Get sources from the last search operation"""
-        # Check all tools for last_sources attribute
-        for tool in self.tools.values():
-            if hasattr(tool, "last_sources") and tool.last_sources:
-                return tool.last_sources
-        return []
+        """Get sources from the last tool round that found any"""
+        return self.last_sources
 
     def reset_sources(self):
-        """Reset sources from all tools that track sources"""
+        """Reset recorded sources and those of all tools that track sources"""
+        self.last_sources = []
         for tool in self.tools.values():
             if hasattr(tool, "last_sources"):
                 tool.last_sources = []
@@ -0,0 +1,22 @@
+"""Fakes shared across the test suite"""
+
+from dataclasses import dataclass, field
+
+
+@dataclass(frozen=True, slots=True)
+class FakeBlock:
+    """Plain stand-in for an Anthropic content block (far cheaper than MagicMock)"""
+
+    type: str
+    text: str = ""
+    id: str = ""
+    name: str = ""
+    input: dict = field(default_factory=dict)
+
+
+@dataclass(frozen=True, slots=True)
+class FakeResponse:
+    """Plain stand-in for an Anthropic Message"""
+
+    stop_reason: str
+    content: list
@@ -1,17 +1,30 @@
 """Shared test fixtures for the RAG chatbot test suite"""
 
-import os
-import sys
+import copy
+from types import MappingProxyType
 from typing import List
-from unittest.mock import MagicMock
+from unittest.mock import DEFAULT, AsyncMock, Mock, patch
 
 import pytest
 
-# Add backend directory to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-
 from models import Course, Lesson, Source
-from vector_store import SearchResults
+from tests._helpers import FakeBlock, FakeResponse
+
+
+class FakeCollection:
+    """Plain stand-in for a ChromaDB collection returning fixed results"""
+
+    __slots__ = ("_query_result", "_get_result")
+
+    def __init__(self, query_result, get_result):
+        self._query_result = query_result
+        self._get_result = get_result
+
+    def query(self, **kwargs):
+        return self._query_result
+
+    def get(self, **kwargs):
+        return self._get_result
 
 
 # =============================================================================
@@ -21,8 +34,9 @@ from vector_store import SearchResults
 @pytest.fixture
 def mock_rag_system():
     """Mock RAGSystem for API testing"""
-    mock_rag = MagicMock()
-    mock_rag.query.return_value = (
+    mock_rag = Mock()
+    mock_rag.aquery = AsyncMock()
+    mock_rag.aquery.return_value = (
         "This is a test answer from the RAG system.",
         [
             Source(
@@ -33,31 +47,41 @@ def mock_rag_system():
             )
         ]
     )
+
+    async def stream_answer(query, session_id):
+        yield {"type": "text", "text": "This is a test answer "}
+        yield {"type": "text", "text": "from the RAG system."}
+        yield {"type": "sources", "sources": []}
+
+    mock_rag.aquery_stream = Mock(side_effect=stream_answer)
     mock_rag.get_course_analytics.return_value = {
         "total_courses": 2,
         "course_titles": ["Introduction to Python", "Web Development Basics"]
     }
-    mock_rag.session_manager = MagicMock()
+    mock_rag.session_manager = Mock()
     mock_rag.session_manager.create_session.return_value = "test-session-id-123"
     return mock_rag
 
 
-@pytest.fixture
-def test_app(mock_rag_system):
+@pytest.fixture(scope="module")
+def test_app():
     """
     Create a test FastAPI app with API endpoints defined inline.
 
     This avoids import issues with the main app.py which mounts static files
-    that don't exist in the test environment.
+    that don't exist in the test environment. The app is built once per module;
+    the client fixtures install each test's fresh mock_rag_system on app.state.
     """
+    import json
     from fastapi import FastAPI, HTTPException
+    from fastapi.responses import StreamingResponse
     from pydantic import BaseModel
     from typing import Optional
 
     app = FastAPI(title="Test RAG API")
 
-    # Store mock RAG system on app state for access in endpoints
-    app.state.rag_system = mock_rag_system
+    # Replaced per test by the client fixtures below
+    app.state.rag_system = None
 
     class QueryRequest(BaseModel):
         query: str
@@ -79,7 +103,7 @@ def test_app(mock_rag_system):
             if not session_id:
                 session_id = app.state.rag_system.session_manager.create_session()
 
-            answer, sources = app.state.rag_system.query(request.query, session_id)
+            answer, sources = await app.state.rag_system.aquery(request.query, session_id)
 
             return QueryResponse(
                 answer=answer,
@@ -89,6 +113,22 @@ def test_app(mock_rag_system):
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
+    @app.post("/api/query/stream")
+    async def stream_query(request: QueryRequest):
+        session_id = request.session_id
+        if not session_id:
+            session_id = app.state.rag_system.session_manager.create_session()
+
+        async def events():
+            yield f"data: {json.dumps({'type': 'session', 'session_id': session_id})}\n\n"
+            try:
+                async for event in app.state.rag_system.aquery_stream(request.query, session_id):
+                    yield f"data: {json.dumps(event)}\n\n"
+            except Exception as e:
+                yield f"data: {json.dumps({'type': 'error', 'detail': str(e)})}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
     @app.get("/api/courses", response_model=CourseStats)
     async def get_course_stats():
         try:
@@ -107,84 +147,152 @@ def test_app(mock_rag_system):
     return app
 
 
-@pytest.fixture
-def test_client(test_app):
-    """Create a test client for API testing using httpx"""
+@pytest.fixture(scope="module")
+def _async_client(test_app):
+    import asyncio
     from httpx import AsyncClient, ASGITransport
 
-    transport = ASGITransport(app=test_app)
-    return AsyncClient(transport=transport, base_url="http://test")
+    # A sync fixture, so the client isn't tied to any one test's event loop;
+    # ASGITransport holds no connections, so requests work without entering it
+    client = AsyncClient(transport=ASGITransport(app=test_app), base_url="http://test")
+    yield client
+    asyncio.run(client.aclose())
 
 
-@pytest.fixture
-def sync_test_client(test_app):
-    """Create a synchronous test client using Starlette TestClient"""
+@pytest.fixture(scope="module")
+def _sync_client(test_app):
     from starlette.testclient import TestClient
-    return TestClient(test_app)
+
+    with TestClient(test_app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def app_module():
+    """
+    The real backend/app.py, imported with RAGSystem and the static mount
+    patched out. Tests install their mock_rag_system as app_module.rag_system.
+    """
+    with patch("rag_system.RAGSystem"), patch("fastapi.staticfiles.StaticFiles"):
+        import app
+
+    return app
 
 
+# Clients are shared across a module; mock_rag_system stays per test so a
+# side_effect or return_value set by one test never leaks into the next.
 @pytest.fixture
-def mock_config():
-    """Configuration with correct MAX_RESULTS value for testing"""
-    config = MagicMock()
-    config.ANTHROPIC_API_KEY = "test-api-key-123"
-    config.ANTHROPIC_MODEL = "claude-sonnet-4-20250514"
-    config.MAX_RESULTS = 5
-    config.CHUNK_SIZE = 800
-    config.CHUNK_OVERLAP = 100
-    config.MAX_HISTORY = 2
-    config.CHROMA_PATH = "./test_chroma_db"
-    config.EMBEDDING_MODEL = "all-MiniLM-L6-v2"
-    return config
+def test_client(_async_client, test_app, mock_rag_system):
+    """Create a test client for API testing using httpx"""
+    test_app.state.rag_system = mock_rag_system
+    return _async_client
 
 
 @pytest.fixture
+def sync_test_client(_sync_client, test_app, mock_rag_system):
+    """Create a synchronous test client using Starlette TestClient"""
+    test_app.state.rag_system = mock_rag_system
+    return _sync_client
+
+
+# vector_store pulls in ChromaDB (~0.6s), so it is imported inside the fixtures
+# that need it; running only the API tests never loads it.
+# Read-only data fixtures are session-scoped and built once per run; tests must
+# not mutate them. Mocks that tests reconfigure are either function-scoped or
+# reset by a function-scoped fixture before each test.
+
+@pytest.fixture(scope="session")
+def mock_config():
+    """Test configuration; a real frozen Config, so no test can mutate it"""
+    from config import Config
+
+    return Config(
+        ANTHROPIC_API_KEY="test-api-key-123",
+        ANTHROPIC_MODEL="claude-sonnet-4-20250514",
+        MAX_RESULTS=5,
+        CHUNK_SIZE=800,
+        CHUNK_OVERLAP=100,
+        MAX_HISTORY=2,
+        CHROMA_PATH="./test_chroma_db",
+        EMBEDDING_MODEL="all-MiniLM-L6-v2",
+        RESPONSE_CACHE_ENABLED=False,
+        RESPONSE_CACHE_SIZE=1024,
+        SEMANTIC_CACHE_THRESHOLD=0.92,
+        SEMANTIC_CACHE_CONTEXT_THRESHOLD=0.85,
+        MAX_CONCURRENT_API_CALLS=32,
+    )
+
+
+@pytest.fixture(scope="session")
 def sample_search_results():
-    """Valid SearchResults with multiple documents"""
+    """Valid SearchResults with multiple documents (tuples and read-only metadata)"""
+    from vector_store import SearchResults
+
     return SearchResults(
-        documents=[
+        documents=(
             "MCP (Model Context Protocol) is a protocol for connecting AI models to data sources.",
             "The MCP server allows tools to access external data and services.",
-        ],
-        metadata=[
-            {
-                "course_title": "Introduction to MCP",
-                "lesson_number": 1,
-                "chunk_index": 0,
-            },
-            {
-                "course_title": "Introduction to MCP",
-                "lesson_number": 2,
-                "chunk_index": 1,
-            },
-        ],
-        distances=[0.3, 0.5],
+        ),
+        metadata=(
+            MappingProxyType(
+                {
+                    "course_title": "Introduction to MCP",
+                    "lesson_number": 1,
+                    "chunk_index": 0,
+                }
+            ),
+            MappingProxyType(
+                {
+                    "course_title": "Introduction to MCP",
+                    "lesson_number": 2,
+                    "chunk_index": 1,
+                }
+            ),
+        ),
+        distances=(0.3, 0.5),
     )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def empty_search_results():
-    """SearchResults with no documents"""
-    return SearchResults(documents=[], metadata=[], distances=[])
+    """SearchResults with no documents (empty tuples, like sample_search_results)"""
+    from vector_store import SearchResults
 
+    return SearchResults(documents=(), metadata=(), distances=())
 
-@pytest.fixture
+
+@pytest.fixture(scope="session")
 def error_search_results():
     """SearchResults with error message"""
+    from vector_store import SearchResults
+
     return SearchResults.empty("No course found matching 'NonExistent'")
 
 
+@pytest.fixture(scope="session")
+def _mock_vector_store():
+    """The Mock behind mock_vector_store, built once per run"""
+    from vector_store import VectorStore
+
+    # spec_set: a misspelt VectorStore method fails instead of returning a Mock
+    return Mock(spec_set=VectorStore)
+
+
 @pytest.fixture
-def mock_vector_store(sample_search_results):
-    """Mocked VectorStore that returns valid search results"""
-    mock_store = MagicMock()
+def mock_vector_store(_mock_vector_store, sample_search_results):
+    """
+    Mocked VectorStore that returns valid search results. The session's Mock is
+    reset and given its default replies first, so overrides never leak.
+    """
+    mock_store = _mock_vector_store
+    mock_store.reset_mock(return_value=True, side_effect=True)
     mock_store.search.return_value = sample_search_results
     mock_store._resolve_course_name.return_value = "Introduction to MCP"
     mock_store.get_lesson_link.return_value = "https://example.com/lesson/1"
     return mock_store
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_course():
     """Sample Course object for testing"""
     return Course(
@@ -211,10 +319,10 @@ def sample_course():
     )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_sources():
-    """Sample Source objects for testing"""
-    return [
+    """Sample Source objects for testing (a tuple, so tests cannot append to it)"""
+    return (
         Source(
             text="Introduction to MCP - Lesson 1",
             url="https://example.com/lesson/1",
@@ -227,94 +335,91 @@ def sample_sources():
             course_title="Introduction to MCP",
             lesson_number=2,
         ),
-    ]
-
-
-@pytest.fixture
-def mock_anthropic_text_response():
-    """Mock Anthropic response without tool use"""
-    mock_response = MagicMock()
-    mock_response.stop_reason = "end_turn"
-
-    # Create mock content block
-    mock_content = MagicMock()
-    mock_content.text = "MCP stands for Model Context Protocol. It's a standardized way for AI models to connect to data sources."
-    mock_content.type = "text"
-
-    mock_response.content = [mock_content]
-    return mock_response
-
-
-@pytest.fixture
-def mock_anthropic_tool_use_response():
-    """Mock Anthropic response requesting tool use"""
-    mock_response = MagicMock()
-    mock_response.stop_reason = "tool_use"
-
-    # Create mock tool use content block
-    mock_tool_block = MagicMock()
-    mock_tool_block.type = "tool_use"
-    mock_tool_block.id = "toolu_01234567890"
-    mock_tool_block.name = "search_course_content"
-    mock_tool_block.input = {"query": "What is MCP?", "course_name": "MCP"}
-
-    mock_response.content = [mock_tool_block]
-    return mock_response
+    )
 
 
-@pytest.fixture
-def mock_anthropic_final_response():
-    """Mock Anthropic final response after tool execution"""
-    mock_response = MagicMock()
-    mock_response.stop_reason = "end_turn"
+@pytest.fixture(scope="session")
+def multi_course_sources():
+    """Sources spanning two courses and several lessons (a tuple, so tests cannot append to it)"""
+    return (
+        Source(
+            text="Course A - Lesson 1",
+            url="https://example.com/a/1",
+            course_title="Course A",
+            lesson_number=1,
+        ),
+        Source(
+            text="Course A - Lesson 2",
+            url="https://example.com/a/2",
+            course_title="Course A",
+            lesson_number=2,
+        ),
+        Source(
+            text="Course B - Lesson 1",
+            url="https://example.com/b/1",
+            course_title="Course B",
+            lesson_number=1,
+        ),
+    )
 
-    # Create mock content block
-    mock_content = MagicMock()
-    mock_content.text = "Based on the course materials, MCP (Model Context Protocol) is a protocol that allows AI models to connect to external data sources and tools."
-    mock_content.type = "text"
 
-    mock_response.content = [mock_content]
-    return mock_response
+@pytest.fixture(scope="session")
+def make_anthropic_response():
+    """
+    Factory for Anthropic responses: make_anthropic_response("text", "...") for
+    an answer, make_anthropic_response("tool_use", ...) for a tool call. A tool
+    call defaults to searching course content for "What is MCP?".
+    """
 
+    def _make(kind, text="", tool_id="toolu_01234567890", name="search_course_content", tool_input=None):
+        if kind == "text":
+            return FakeResponse(stop_reason="end_turn", content=[FakeBlock(type="text", text=text)])
+        if tool_input is None:
+            tool_input = {"query": "What is MCP?", "course_name": "MCP"}
+        return FakeResponse(
+            stop_reason="tool_use",
+            content=[FakeBlock(type="tool_use", id=tool_id, name=name, input=tool_input)],
+        )
 
-@pytest.fixture
-def mock_anthropic_client(mock_anthropic_text_response):
-    """Mock Anthropic client with messages.create method"""
-    mock_client = MagicMock()
-    mock_client.messages.create.return_value = mock_anthropic_text_response
-    return mock_client
+    return _make
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_chroma_collection():
-    """Mock ChromaDB collection"""
-    mock_collection = MagicMock()
-    mock_collection.query.return_value = {
-        "documents": [["Sample document content"]],
-        "metadatas": [[{"course_title": "Test Course", "lesson_number": 1}]],
-        "distances": [[0.3]],
-    }
-    mock_collection.get.return_value = {
-        "ids": ["test_course_1"],
-        "metadatas": [
-            {
-                "title": "Test Course",
-                "instructor": "Test Instructor",
-                "course_link": "https://example.com/course",
-                "lessons_json": '[{"lesson_number": 1, "lesson_title": "Intro", "lesson_link": "https://example.com/lesson/1"}]',
-            }
-        ],
-    }
-    return mock_collection
+    """Fake ChromaDB collection"""
+    return FakeCollection(
+        query_result={
+            "documents": [["Sample document content"]],
+            "metadatas": [[{"course_title": "Test Course", "lesson_number": 1}]],
+            "distances": [[0.3]],
+        },
+        get_result={
+            "ids": ["test_course_1"],
+            "metadatas": [
+                {
+                    "title": "Test Course",
+                    "instructor": "Test Instructor",
+                    "course_link": "https://example.com/course",
+                    "lessons_json": '[{"lesson_number": 1, "lesson_title": "Intro", "lesson_link": "https://example.com/lesson/1"}]',
+                }
+            ],
+        },
+    )
 
 
 @pytest.fixture
 def mock_tool_manager(sample_sources):
     """Mock ToolManager"""
-    mock_manager = MagicMock()
+    from search_tools import ToolManager
+
+    # spec_set: a misspelt ToolManager method fails instead of returning a Mock
+    mock_manager = Mock(spec_set=ToolManager)
     mock_manager.execute_tool.return_value = (
         "[Introduction to MCP - Lesson 1]\nMCP is a protocol for AI models."
     )
+    mock_manager.aexecute_tool_with_sources = AsyncMock(
+        return_value=(mock_manager.execute_tool.return_value, list(sample_sources))
+    )
     mock_manager.get_last_sources.return_value = sample_sources
     mock_manager.get_tool_definitions.return_value = [
         {
@@ -334,74 +439,94 @@ def mock_tool_manager(sample_sources):
     return mock_manager
 
 
-@pytest.fixture
-def mock_anthropic_second_tool_use_response():
-    """Mock response for second round of tool use"""
-    mock_response = MagicMock()
-    mock_response.stop_reason = "tool_use"
-
-    mock_tool_block = MagicMock()
-    mock_tool_block.type = "tool_use"
-    mock_tool_block.id = "toolu_round2_abc"
-    mock_tool_block.name = "search_course_content"
-    mock_tool_block.input = {
-        "query": "MCP Architecture details",
-        "course_name": "MCP",
-        "lesson_number": 2,
-    }
-    mock_response.content = [mock_tool_block]
-    return mock_response
+@pytest.fixture(scope="session")
+def mock_anthropic_multi_round_sequence(make_anthropic_response):
+    """Sequence of responses for 2-round tool calling"""
+    return (
+        # Response 1: First tool use (get course outline)
+        make_anthropic_response(
+            "tool_use", tool_id="toolu_round1", name="get_course_outline", tool_input={"course_name": "MCP"}
+        ),
+        # Response 2: Second tool use (search content)
+        make_anthropic_response(
+            "tool_use", tool_id="toolu_round2", tool_input={"query": "MCP Architecture", "lesson_number": 2}
+        ),
+        # Response 3: Final text answer
+        make_anthropic_response(
+            "text",
+            "Based on the course outline and detailed search, MCP Architecture covers the core protocol design and implementation patterns.",
+        ),
+    )
+
+
+# =============================================================================
+# AI Generator Fixtures
+# =============================================================================
+
+@pytest.fixture(scope="module")
+def patched_anthropic(request):
+    """
+    anthropic.Anthropic patched once per module. Returns the client mock that
+    every AIGenerator built in the module receives; tests get it through
+    anthropic_client so it is cleared between them.
+    """
+    import anthropic
+
+    # spec_set against the real class: a misspelt client attribute fails loudly
+    client = Mock(spec_set=anthropic.Anthropic)
+    patcher = patch("anthropic.Anthropic")
+    anthropic_class = patcher.start()
+    request.addfinalizer(patcher.stop)
+    anthropic_class.return_value = client
+    return client
+
+
+@pytest.fixture(scope="module")
+def ai_generator(patched_anthropic):
+    """AIGenerator on the patched client, built once per module"""
+    from ai_generator import AIGenerator
+
+    return AIGenerator(api_key="test_key", model="claude-sonnet-4-20250514")
 
 
 @pytest.fixture
-def mock_anthropic_multi_round_sequence(
-    mock_anthropic_tool_use_response,
-    mock_anthropic_second_tool_use_response,
-    mock_anthropic_final_response,
-):
-    """Sequence of responses for 2-round tool calling"""
-    # Response 1: First tool use (get course outline)
-    response1 = MagicMock()
-    response1.stop_reason = "tool_use"
-    tool_block1 = MagicMock()
-    tool_block1.type = "tool_use"
-    tool_block1.id = "toolu_round1"
-    tool_block1.name = "get_course_outline"
-    tool_block1.input = {"course_name": "MCP"}
-    response1.content = [tool_block1]
-
-    # Response 2: Second tool use (search content)
-    response2 = MagicMock()
-    response2.stop_reason = "tool_use"
-    tool_block2 = MagicMock()
-    tool_block2.type = "tool_use"
-    tool_block2.id = "toolu_round2"
-    tool_block2.name = "search_course_content"
-    tool_block2.input = {"query": "MCP Architecture", "lesson_number": 2}
-    response2.content = [tool_block2]
-
-    # Response 3: Final text answer
-    response3 = MagicMock()
-    response3.stop_reason = "end_turn"
-    text_block = MagicMock()
-    text_block.type = "text"
-    text_block.text = "Based on the course outline and detailed search, MCP Architecture covers the core protocol design and implementation patterns."
-    response3.content = [text_block]
-
-    return [response1, response2, response3]
+def anthropic_client(patched_anthropic):
+    """The module's patched client with the previous test's calls and replies cleared"""
+    patched_anthropic.reset_mock(return_value=True, side_effect=True)
+    return patched_anthropic
+
+
+# =============================================================================
+# RAG System Fixtures
+# =============================================================================
+
+@pytest.fixture(scope="session")
+def _rag_system_template(mock_config):
+    """RAGSystem constructed once, with its heavy dependencies patched out"""
+    from rag_system import RAGSystem
+
+    with patch.multiple(
+        "rag_system",
+        VectorStore=DEFAULT,
+        AIGenerator=DEFAULT,
+        DocumentProcessor=DEFAULT,
+        SessionManager=DEFAULT,
+    ):
+        return RAGSystem(mock_config)
 
 
 @pytest.fixture
-def mock_anthropic_infinite_tool_use():
-    """Mock response that always requests tools (for testing max rounds)"""
-    mock_response = MagicMock()
-    mock_response.stop_reason = "tool_use"
-
-    mock_tool_block = MagicMock()
-    mock_tool_block.type = "tool_use"
-    mock_tool_block.id = "toolu_infinite"
-    mock_tool_block.name = "search_course_content"
-    mock_tool_block.input = {"query": "test query"}
-
-    mock_response.content = [mock_tool_block]
-    return mock_response
+def rag_system(_rag_system_template):
+    """
+    RAGSystem with fresh mocked collaborators for each test.
+
+    A shallow copy of the session template skips __init__ and the patching;
+    every attribute a test can mutate is replaced so nothing leaks between tests.
+    """
+    rag = copy.copy(_rag_system_template)
+    rag.vector_store = Mock()
+    rag.ai_generator = Mock()
+    rag.tool_manager = Mock()
+    rag.session_manager = Mock()
+    rag._inflight = {}
+    return rag
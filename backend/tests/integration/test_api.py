@@ -1,186 +1,204 @@
 """API endpoint tests for the RAG chatbot FastAPI application"""
 import pytest
-from unittest.mock import MagicMock
-import sys
-import os
 
-# Add backend directory to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
-
-from models import Source
+# Built once at import and shared by every parametrized case that needs them
+_MANY_COURSE_TITLES = tuple(f"Course {i}" for i in range(50))
+_LONG_QUERY = "word " * 1000  # 5000 character query
+_UNICODE_QUERY = "What is 日本語? How about émojis 🎉?"
+_DB_ERROR = Exception("Database connection failed")
+_CHROMA_ERROR = Exception("ChromaDB unavailable")
 
 
 @pytest.mark.api
 class TestQueryEndpoint:
     """Tests for POST /api/query endpoint"""
 
-    def test_query_success_with_sources(self, sync_test_client, mock_rag_system):
-        """Test successful query returns answer and sources"""
+    @pytest.mark.parametrize(
+        "payload, expected_session_id, creates_session",
+        [
+            pytest.param(
+                {"query": "What is MCP?", "session_id": "existing-session"},
+                "existing-session",
+                False,
+                id="with-session"
+            ),
+            pytest.param(
+                {"query": "What is Python?"},
+                "test-session-id-123",
+                True,
+                id="auto-session"
+            ),
+            # Empty query is valid input - the RAG system handles it
+            pytest.param(
+                {"query": "", "session_id": "test-session"},
+                "test-session",
+                False,
+                id="empty-query"
+            ),
+        ]
+    )
+    def test_query_success(self, sync_test_client, mock_rag_system, payload, expected_session_id, creates_session):
+        """Test that a query returns the answer, its sources and the session"""
         # Act
-        response = sync_test_client.post(
-            "/api/query",
-            json={"query": "What is MCP?", "session_id": "existing-session"}
-        )
+        response = sync_test_client.post("/api/query", json=payload)
 
         # Assert
         assert response.status_code == 200
         data = response.json()
-        assert "answer" in data
-        assert "sources" in data
-        assert "session_id" in data
-        assert data["answer"] == "This is a test answer from the RAG system."
+        assert {"answer": "This is a test answer from the RAG system.", "session_id": expected_session_id}.items() <= data.items()
         assert len(data["sources"]) == 1
         assert data["sources"][0]["course_title"] == "Test Course"
-        assert data["session_id"] == "existing-session"
-
-    def test_query_creates_session_when_not_provided(self, sync_test_client, mock_rag_system):
-        """Test that session is created when session_id is not provided"""
-        # Act
-        response = sync_test_client.post(
-            "/api/query",
-            json={"query": "What is Python?"}
-        )
-
-        # Assert
-        assert response.status_code == 200
-        data = response.json()
-        assert data["session_id"] == "test-session-id-123"
-        mock_rag_system.session_manager.create_session.assert_called_once()
+        assert mock_rag_system.session_manager.create_session.called == creates_session
+        mock_rag_system.aquery.assert_called_once_with(payload["query"], expected_session_id)
+
+    @pytest.mark.parametrize(
+        "answer, sources_fixture",
+        [
+            pytest.param("Answer without sources", None, id="no-sources"),
+            pytest.param(
+                "Comprehensive answer from multiple lessons",
+                "multi_course_sources",
+                id="multiple-sources"
+            ),
+        ]
+    )
+    def test_query_returns_sources(self, request, sync_test_client, mock_rag_system, answer, sources_fixture):
+        """Test that the response carries whatever sources the RAG system found"""
+        # Arrange
+        sources = request.getfixturevalue(sources_fixture) if sources_fixture else []
+        mock_rag_system.aquery.return_value = (answer, sources)
 
-    def test_query_uses_provided_session_id(self, sync_test_client, mock_rag_system):
-        """Test that provided session_id is used"""
         # Act
         response = sync_test_client.post(
             "/api/query",
-            json={"query": "Tell me more", "session_id": "user-provided-session"}
+            json={"query": "Compare topics", "session_id": "test-session"}
         )
 
         # Assert
         assert response.status_code == 200
         data = response.json()
-        assert data["session_id"] == "user-provided-session"
-        mock_rag_system.session_manager.create_session.assert_not_called()
+        assert data["answer"] == answer
+        assert [s["course_title"] for s in data["sources"]] == [s.course_title for s in sources]
 
-    def test_query_empty_sources(self, sync_test_client, mock_rag_system):
-        """Test query response when no sources are found"""
+    def test_query_rag_system_error(self, sync_test_client, mock_rag_system):
+        """Test that RAG system errors return 500 status"""
         # Arrange
-        mock_rag_system.query.return_value = ("Answer without sources", [])
+        mock_rag_system.aquery.side_effect = _DB_ERROR
 
         # Act
         response = sync_test_client.post(
             "/api/query",
-            json={"query": "Generic question", "session_id": "test-session"}
+            json={"query": "Test query", "session_id": "test-session"}
         )
 
         # Assert
-        assert response.status_code == 200
-        data = response.json()
-        assert data["answer"] == "Answer without sources"
-        assert data["sources"] == []
-
-    def test_query_missing_query_field(self, sync_test_client):
-        """Test that missing query field returns 422 validation error"""
-        # Act
-        response = sync_test_client.post(
-            "/api/query",
-            json={"session_id": "test-session"}
-        )
+        assert response.status_code == 500
+        assert str(_DB_ERROR) in response.json()["detail"]
 
-        # Assert
-        assert response.status_code == 422
 
-    def test_query_empty_query_string(self, sync_test_client, mock_rag_system):
-        """Test query with empty string"""
+@pytest.mark.api
+class TestStreamQueryEndpoint:
+    """Tests for POST /api/query/stream endpoint"""
+
+    @staticmethod
+    def parse_events(body):
+        """Decode the JSON payloads of a server-sent events body"""
+        import json
+        return [
+            json.loads(line[len("data: "):])
+            for line in body.splitlines()
+            if line.startswith("data: ")
+        ]
+
+    def test_stream_yields_session_text_and_sources(self, sync_test_client, mock_rag_system):
+        """Test that the stream starts with the session and ends with sources"""
         # Act
         response = sync_test_client.post(
-            "/api/query",
-            json={"query": "", "session_id": "test-session"}
+            "/api/query/stream",
+            json={"query": "What is MCP?"}
         )
 
         # Assert
-        # Empty query is valid input - the RAG system handles it
         assert response.status_code == 200
-        mock_rag_system.query.assert_called_once_with("", "test-session")
-
-    def test_query_rag_system_error(self, sync_test_client, mock_rag_system):
-        """Test that RAG system errors return 500 status"""
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = self.parse_events(response.text)
+        assert events[0] == {"type": "session", "session_id": "test-session-id-123"}
+        text = "".join(e["text"] for e in events if e["type"] == "text")
+        assert text == "This is a test answer from the RAG system."
+        assert events[-1]["type"] == "sources"
+        mock_rag_system.aquery_stream.assert_called_once_with("What is MCP?", "test-session-id-123")
+
+    def test_stream_reports_errors_in_band(self, sync_test_client, mock_rag_system):
+        """Test that a failure after streaming starts becomes an error event"""
         # Arrange
-        mock_rag_system.query.side_effect = Exception("Database connection failed")
+        async def failing_stream(query, session_id):
+            yield {"type": "text", "text": "Partial"}
+            raise _DB_ERROR
+
+        mock_rag_system.aquery_stream.side_effect = failing_stream
 
         # Act
         response = sync_test_client.post(
-            "/api/query",
-            json={"query": "Test query", "session_id": "test-session"}
+            "/api/query/stream",
+            json={"query": "What is MCP?", "session_id": "test-session"}
         )
 
         # Assert
-        assert response.status_code == 500
-        assert "Database connection failed" in response.json()["detail"]
+        events = self.parse_events(response.text)
+        assert events[-1] == {"type": "error", "detail": str(_DB_ERROR)}
+
+    def test_app_stream_endpoint_forwards_events(self, app_module, mock_rag_system, monkeypatch):
+        """Test backend/app.py's own stream endpoint, interim markers included"""
+        from starlette.testclient import TestClient
 
-    def test_query_multiple_sources(self, sync_test_client, mock_rag_system):
-        """Test query returning multiple sources"""
         # Arrange
-        mock_rag_system.query.return_value = (
-            "Comprehensive answer from multiple lessons",
-            [
-                Source(
-                    text="Course A - Lesson 1",
-                    url="https://example.com/a/1",
-                    course_title="Course A",
-                    lesson_number=1
-                ),
-                Source(
-                    text="Course A - Lesson 2",
-                    url="https://example.com/a/2",
-                    course_title="Course A",
-                    lesson_number=2
-                ),
-                Source(
-                    text="Course B - Lesson 1",
-                    url="https://example.com/b/1",
-                    course_title="Course B",
-                    lesson_number=1
-                )
-            ]
-        )
+        async def stream_with_preamble(query, session_id):
+            yield {"type": "text", "text": "Let me search. "}
+            yield {"type": "interim"}
+            yield {"type": "text", "text": "MCP is a protocol"}
+            yield {"type": "sources", "sources": []}
+
+        mock_rag_system.aquery_stream.side_effect = stream_with_preamble
+        monkeypatch.setattr(app_module, "rag_system", mock_rag_system)
 
         # Act
-        response = sync_test_client.post(
-            "/api/query",
-            json={"query": "Compare topics", "session_id": "test-session"}
+        # Not entered as a context manager, so startup document loading is skipped
+        response = TestClient(app_module.app).post(
+            "/api/query/stream",
+            json={"query": "What is MCP?"}
         )
 
         # Assert
         assert response.status_code == 200
-        data = response.json()
-        assert len(data["sources"]) == 3
-        assert data["sources"][0]["course_title"] == "Course A"
-        assert data["sources"][2]["course_title"] == "Course B"
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert self.parse_events(response.text) == [
+            {"type": "session", "session_id": "test-session-id-123"},
+            {"type": "text", "text": "Let me search. "},
+            {"type": "interim"},
+            {"type": "text", "text": "MCP is a protocol"},
+            {"type": "sources", "sources": []},
+        ]
+        mock_rag_system.aquery_stream.assert_called_once_with("What is MCP?", "test-session-id-123")
 
 
 @pytest.mark.api
 class TestCoursesEndpoint:
     """Tests for GET /api/courses endpoint"""
 
-    def test_get_courses_success(self, sync_test_client, mock_rag_system):
+    @pytest.mark.parametrize(
+        "course_titles",
+        [
+            pytest.param(("Introduction to Python", "Web Development Basics"), id="populated"),
+            pytest.param((), id="empty"),
+            pytest.param(_MANY_COURSE_TITLES, id="many-courses"),
+        ]
+    )
+    def test_get_courses_success(self, sync_test_client, mock_rag_system, course_titles):
         """Test successful retrieval of course statistics"""
-        # Act
-        response = sync_test_client.get("/api/courses")
-
-        # Assert
-        assert response.status_code == 200
-        data = response.json()
-        assert data["total_courses"] == 2
-        assert len(data["course_titles"]) == 2
-        assert "Introduction to Python" in data["course_titles"]
-        assert "Web Development Basics" in data["course_titles"]
-
-    def test_get_courses_empty(self, sync_test_client, mock_rag_system):
-        """Test response when no courses are loaded"""
         # Arrange
         mock_rag_system.get_course_analytics.return_value = {
-            "total_courses": 0,
-            "course_titles": []
+            "total_courses": len(course_titles),
+            "course_titles": course_titles
         }
 
         # Act
@@ -188,39 +206,19 @@ class TestCoursesEndpoint:
 
         # Assert
         assert response.status_code == 200
-        data = response.json()
-        assert data["total_courses"] == 0
-        assert data["course_titles"] == []
+        assert response.json() == {"total_courses": len(course_titles), "course_titles": list(course_titles)}
 
     def test_get_courses_error(self, sync_test_client, mock_rag_system):
         """Test that analytics errors return 500 status"""
         # Arrange
-        mock_rag_system.get_course_analytics.side_effect = Exception("ChromaDB unavailable")
+        mock_rag_system.get_course_analytics.side_effect = _CHROMA_ERROR
 
         # Act
         response = sync_test_client.get("/api/courses")
 
         # Assert
         assert response.status_code == 500
-        assert "ChromaDB unavailable" in response.json()["detail"]
-
-    def test_get_courses_many_courses(self, sync_test_client, mock_rag_system):
-        """Test response with many courses"""
-        # Arrange
-        course_titles = [f"Course {i}" for i in range(50)]
-        mock_rag_system.get_course_analytics.return_value = {
-            "total_courses": 50,
-            "course_titles": course_titles
-        }
-
-        # Act
-        response = sync_test_client.get("/api/courses")
-
-        # Assert
-        assert response.status_code == 200
-        data = response.json()
-        assert data["total_courses"] == 50
-        assert len(data["course_titles"]) == 50
+        assert str(_CHROMA_ERROR) in response.json()["detail"]
 
 
 @pytest.mark.api
@@ -243,76 +241,56 @@ class TestRootEndpoint:
 class TestAPIRequestValidation:
     """Tests for API request validation and edge cases"""
 
-    def test_invalid_json_body(self, sync_test_client):
-        """Test handling of invalid JSON in request body"""
+    @pytest.mark.parametrize(
+        "request_kwargs",
+        [
+            pytest.param({"json": {"session_id": "test-session"}}, id="missing-query-field"),
+            pytest.param(
+                {"content": "not valid json", "headers": {"Content-Type": "application/json"}},
+                id="invalid-json"
+            ),
+            pytest.param(
+                {"content": "query=test", "headers": {"Content-Type": "application/x-www-form-urlencoded"}},
+                id="wrong-content-type"
+            ),
+        ]
+    )
+    def test_invalid_request_rejected(self, sync_test_client, mock_rag_system, request_kwargs):
+        """Test that malformed request bodies return 422 validation errors"""
         # Act
-        response = sync_test_client.post(
-            "/api/query",
-            content="not valid json",
-            headers={"Content-Type": "application/json"}
-        )
+        response = sync_test_client.post("/api/query", **request_kwargs)
 
         # Assert
         assert response.status_code == 422
-
-    def test_wrong_content_type(self, sync_test_client):
-        """Test handling of wrong content type"""
+        mock_rag_system.aquery.assert_not_called()
+
+    @pytest.mark.parametrize(
+        "payload",
+        [
+            pytest.param(
+                {
+                    "query": "Test query",
+                    "session_id": "test-session",
+                    "extra_field": "should be ignored",
+                    "another_field": 12345
+                },
+                id="extra-fields-ignored"
+            ),
+            pytest.param(
+                {"query": _UNICODE_QUERY, "session_id": "test"},
+                id="unicode"
+            ),
+            pytest.param({"query": _LONG_QUERY, "session_id": "test"}, id="long-query"),
+        ]
+    )
+    def test_unusual_query_accepted(self, sync_test_client, mock_rag_system, payload):
+        """Test that extra fields, unicode and very long queries pass through intact"""
         # Act
-        response = sync_test_client.post(
-            "/api/query",
-            content="query=test",
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
-
-        # Assert
-        assert response.status_code == 422
-
-    def test_extra_fields_ignored(self, sync_test_client, mock_rag_system):
-        """Test that extra fields in request are ignored"""
-        # Act
-        response = sync_test_client.post(
-            "/api/query",
-            json={
-                "query": "Test query",
-                "session_id": "test-session",
-                "extra_field": "should be ignored",
-                "another_field": 12345
-            }
-        )
-
-        # Assert
-        assert response.status_code == 200
-        mock_rag_system.query.assert_called_once_with("Test query", "test-session")
-
-    def test_unicode_query(self, sync_test_client, mock_rag_system):
-        """Test handling of unicode characters in query"""
-        # Act
-        response = sync_test_client.post(
-            "/api/query",
-            json={"query": "What is 日本語? How about émojis 🎉?", "session_id": "test"}
-        )
-
-        # Assert
-        assert response.status_code == 200
-        mock_rag_system.query.assert_called_once_with(
-            "What is 日本語? How about émojis 🎉?",
-            "test"
-        )
-
-    def test_long_query(self, sync_test_client, mock_rag_system):
-        """Test handling of very long query strings"""
-        # Arrange
-        long_query = "word " * 1000  # 5000 character query
-
-        # Act
-        response = sync_test_client.post(
-            "/api/query",
-            json={"query": long_query, "session_id": "test"}
-        )
+        response = sync_test_client.post("/api/query", json=payload)
 
         # Assert
         assert response.status_code == 200
-        mock_rag_system.query.assert_called_once()
+        mock_rag_system.aquery.assert_called_once_with(payload["query"], payload["session_id"])
 
 
 @pytest.mark.api
@@ -322,11 +300,10 @@ class TestAsyncAPIEndpoints:
     @pytest.mark.asyncio
     async def test_async_query_endpoint(self, test_client, mock_rag_system):
         """Test query endpoint with async client"""
-        async with test_client:
-            response = await test_client.post(
-                "/api/query",
-                json={"query": "Async test query", "session_id": "async-session"}
-            )
+        response = await test_client.post(
+            "/api/query",
+            json={"query": "Async test query", "session_id": "async-session"}
+        )
 
         assert response.status_code == 200
         data = response.json()
@@ -335,8 +312,7 @@ class TestAsyncAPIEndpoints:
     @pytest.mark.asyncio
     async def test_async_courses_endpoint(self, test_client, mock_rag_system):
         """Test courses endpoint with async client"""
-        async with test_client:
-            response = await test_client.get("/api/courses")
+        response = await test_client.get("/api/courses")
 
         assert response.status_code == 200
         data = response.json()
@@ -347,17 +323,16 @@ class TestAsyncAPIEndpoints:
         """Test handling of concurrent requests"""
         import asyncio
 
-        async with test_client:
-            # Make multiple concurrent requests
-            tasks = [
-                test_client.post(
-                    "/api/query",
-                    json={"query": f"Query {i}", "session_id": f"session-{i}"}
-                )
-                for i in range(5)
-            ]
-            responses = await asyncio.gather(*tasks)
+        # Make multiple concurrent requests
+        tasks = [
+            test_client.post(
+                "/api/query",
+                json={"query": f"Query {i}", "session_id": f"session-{i}"}
+            )
+            for i in range(5)
+        ]
+        responses = await asyncio.gather(*tasks)
 
         # All requests should succeed
         assert all(r.status_code == 200 for r in responses)
-        assert mock_rag_system.query.call_count == 5
+        assert mock_rag_system.aquery.call_count == 5
@@ -0,0 +1,187 @@
+"""Unit tests for the semantic response cache"""
+
+import threading
+
+import numpy as np
+import pytest
+
+from response_cache import SemanticCache, contains_pii
+
+MCP_HISTORY = "User: Tell me about MCP\nAssistant: MCP is a protocol."
+SIMILAR_MCP_HISTORY = "User: tell me about MCP\nAssistant: MCP is a protocol!"
+PYTHON_HISTORY = "User: Tell me about Python\nAssistant: Python is a language."
+
+# Hand-picked 3-d embeddings: the two MCP phrasings are ~0.99 similar, the
+# Python question is orthogonal to both. Histories are keyed as the cache
+# sees them, with whitespace collapsed.
+EMBEDDINGS = {
+    "What is MCP?": [1.0, 0.0, 0.0],
+    "what's MCP": [0.99, 0.1, 0.0],
+    "What is Python?": [0.0, 0.0, 1.0],
+    " ".join(MCP_HISTORY.split()): [0.0, 1.0, 0.0],
+    " ".join(SIMILAR_MCP_HISTORY.split()): [0.0, 0.95, 0.3],
+    " ".join(PYTHON_HISTORY.split()): [0.0, 0.0, 1.0],
+}
+
+
+class FakeEmbeddingFunction:
+    """Deterministic embedding function that counts encode calls"""
+
+    def __init__(self):
+        self.calls = 0
+        self.threads = set()
+
+    def __call__(self, texts):
+        self.calls += 1
+        self.threads.add(threading.get_ident())
+        return [EMBEDDINGS[text] for text in texts]
+
+
+class TestSemanticCache:
+    """Test SemanticCache lookup, storage and eviction"""
+
+    @pytest.fixture
+    def embedding_function(self):
+        return FakeEmbeddingFunction()
+
+    @pytest.fixture
+    def cache(self, embedding_function):
+        return SemanticCache(embedding_function, threshold=0.90)
+
+    def test_empty_cache_misses_without_embedding(self, cache, embedding_function):
+        """Test that lookups on an empty cache skip the embedding model"""
+        assert cache.get("What is MCP?") is None
+        assert embedding_function.calls == 0
+
+    def test_similar_query_hits(self, cache, sample_sources):
+        """Test that a paraphrased query returns the cached answer and sources"""
+        cache.put("What is MCP?", None, "MCP is a protocol.", sample_sources)
+
+        cached = cache.get("what's MCP")
+
+        assert cached is not None
+        assert cached.answer == "MCP is a protocol."
+        assert cached.sources == list(sample_sources)
+
+    def test_dissimilar_query_misses(self, cache):
+        """Test that an unrelated query does not reuse a cached answer"""
+        cache.put("What is MCP?", None, "MCP is a protocol.", [])
+
+        assert cache.get("What is Python?") is None
+
+    def test_different_context_misses(self, cache):
+        """Test that the same query in a different conversation is not reused"""
+        cache.put("What is MCP?", MCP_HISTORY, "MCP is...", [])
+
+        assert cache.get("What is MCP?", None) is None
+        assert cache.get("What is MCP?", PYTHON_HISTORY) is None
+        assert cache.get("What is MCP?", MCP_HISTORY) is not None
+
+    def test_similar_context_hits(self, cache):
+        """Test that a paraphrased query in a similar conversation is reused"""
+        cache.put("What is MCP?", MCP_HISTORY, "MCP is...", [])
+
+        cached = cache.get("what's MCP", SIMILAR_MCP_HISTORY)
+
+        assert cached is not None
+        assert cached.answer == "MCP is..."
+
+    def test_answer_with_pii_not_cached(self, cache):
+        """Test that answers containing personal data are never stored"""
+        cache.put("What is MCP?", None, "Email jane.doe@example.com for help.", [])
+
+        assert len(cache) == 0
+        assert cache.get("What is MCP?") is None
+
+    def test_put_reuses_lookup_embedding(self, cache, embedding_function):
+        """Test that a miss followed by put() only encodes the query once"""
+        cache.put("What is Python?", None, "A language.", [])
+        embedding_function.calls = 0
+
+        assert cache.get("What is MCP?") is None
+        cache.put("What is MCP?", None, "MCP is a protocol.", [])
+
+        assert embedding_function.calls == 1
+
+    def test_exact_repeat_skips_embedding(self, cache, embedding_function):
+        """Test that an identical query is served by the hash tier alone"""
+        cache.put("What is MCP?", None, "MCP is a protocol.", [])
+        embedding_function.calls = 0
+
+        cached = cache.get("What is MCP?")
+
+        assert cached.answer == "MCP is a protocol."
+        assert embedding_function.calls == 0
+
+    async def test_async_variants_embed_off_event_loop(self, cache, embedding_function):
+        """Test that aput and aget encode in a worker thread, not on the loop"""
+        await cache.aput("What is MCP?", MCP_HISTORY, "MCP is...", [])
+
+        cached = await cache.aget("what's MCP", SIMILAR_MCP_HISTORY)
+
+        assert cached is not None
+        assert cached.answer == "MCP is..."
+        assert embedding_function.calls == 4
+        assert threading.get_ident() not in embedding_function.threads
+
+    def test_oldest_entry_evicted_when_full(self, embedding_function):
+        """Test that the cache stays within max_entries"""
+        cache = SemanticCache(embedding_function, max_entries=1)
+        cache.put("What is MCP?", None, "MCP is a protocol.", [])
+        cache.put("What is Python?", None, "A language.", [])
+
+        assert len(cache) == 1
+        assert cache.get("What is MCP?") is None
+        assert cache.get("What is Python?").answer == "A language."
+
+    def test_matrix_grows_then_evicts_oldest(self):
+        """Test growth past the initial matrix capacity and ring-buffer eviction"""
+
+        def one_hot(texts):
+            # "question 7" and "paraphrase 7" share the 7th unit vector
+            return [np.eye(40)[int(text.split()[-1])] for text in texts]
+
+        cache = SemanticCache(one_hot, max_entries=20)
+        for i in range(30):
+            cache.put(f"question {i}", None, f"answer {i}", [])
+
+        assert len(cache) == 20
+        assert cache.get("paraphrase 5") is None
+        assert cache.get("paraphrase 10").answer == "answer 10"
+        assert cache.get("paraphrase 29").answer == "answer 29"
+
+    def test_clear(self, cache):
+        """Test that clear() drops all entries"""
+        cache.put("What is MCP?", None, "MCP is a protocol.", [])
+        cache.clear()
+
+        assert len(cache) == 0
+        assert cache.get("What is MCP?") is None
+
+    def test_invalid_threshold_rejected(self, embedding_function):
+        """Test that thresholds outside (0, 1] are rejected"""
+        with pytest.raises(ValueError, match="threshold"):
+            SemanticCache(embedding_function, threshold=1.5)
+
+
+class TestContainsPII:
+    """Test the PII check that guards cache insertion"""
+
+    @pytest.mark.parametrize(
+        "text",
+        [
+            "Contact jane.doe@example.com",
+            "Call +1 (555) 123-4567 today",
+            "SSN 123-45-6789",
+            "Use key sk-ant-REDACTED",
+        ],
+    )
+    def test_detects_pii(self, text):
+        """Test that each kind of personal data is detected"""
+        assert contains_pii(text)
+
+    def test_plain_course_answer_is_clean(self):
+        """Test that ordinary course answers are cacheable"""
+        assert not contains_pii(
+            "Lesson 2 of the MCP course (2024) covers servers, clients and tools."
+        )
@@ -1,213 +1,246 @@
 """Unit tests for CourseSearchTool and ToolManager"""
 
-import os
-import sys
-from unittest.mock import MagicMock
-
 import pytest
 
-# Add backend directory to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../.."))
-
 from models import Source
-from search_tools import CourseSearchTool, Tool, ToolManager
-
-
-class TestCourseSearchTool:
-    """Test CourseSearchTool execution and functionality"""
-
-    def test_execute_basic_query_success(
-        self, mock_vector_store, sample_search_results
-    ):
-        """Test basic search query without filters returns formatted results"""
-        # Arrange
-        tool = CourseSearchTool(mock_vector_store)
-
-        # Act
-        result = tool.execute(query="What is MCP?")
-
-        # Assert
-        assert result is not None
-        assert "MCP (Model Context Protocol)" in result or "MCP" in result
-        assert "Introduction to MCP" in result
-        mock_vector_store.search.assert_called_once_with(
-            query="What is MCP?", course_name=None, lesson_number=None
-        )
-
-    def test_execute_with_course_filter(self, mock_vector_store, sample_search_results):
-        """Test search with course name filter"""
-        # Arrange
-        tool = CourseSearchTool(mock_vector_store)
+from search_tools import CourseOutlineTool, CourseSearchTool, Tool, ToolManager
 
-        # Act
-        result = tool.execute(query="What is MCP?", course_name="MCP")
 
-        # Assert
-        assert result is not None
-        assert "Introduction to MCP" in result
-        mock_vector_store.search.assert_called_once_with(
-            query="What is MCP?", course_name="MCP", lesson_number=None
-        )
+def _assert_called_once_kwargs(mock, **kwargs):
+    """Assert mock was called exactly once, with exactly these keyword arguments"""
+    assert mock.call_count == 1
+    assert mock.call_args.kwargs == kwargs
 
-    def test_execute_with_lesson_filter(self, mock_vector_store, sample_search_results):
-        """Test search with lesson number filter"""
-        # Arrange
-        tool = CourseSearchTool(mock_vector_store)
 
-        # Act
-        result = tool.execute(query="MCP architecture", lesson_number=1)
+class _StubTool(Tool):
+    """Minimal concrete Tool with a fixed definition"""
 
-        # Assert
-        assert result is not None
-        assert "Lesson 1" in result or "MCP" in result
-        mock_vector_store.search.assert_called_once_with(
-            query="MCP architecture", course_name=None, lesson_number=1
-        )
+    __slots__ = ("_definition",)
 
-    def test_execute_course_not_found(self, mock_vector_store, error_search_results):
-        """Test handling when course is not found"""
-        # Arrange
-        mock_vector_store.search.return_value = error_search_results
-        tool = CourseSearchTool(mock_vector_store)
+    def __init__(self, definition):
+        self._definition = definition
 
-        # Act
-        result = tool.execute(query="test query", course_name="NonExistent")
+    def get_tool_definition(self):
+        return self._definition
 
-        # Assert
-        assert "No course found" in result or "NonExistent" in result
+    def execute(self, **kwargs):
+        return ""
 
-    def test_execute_empty_results(self, mock_vector_store, empty_search_results):
-        """Test handling when search returns no results"""
-        # Arrange
-        mock_vector_store.search.return_value = empty_search_results
-        tool = CourseSearchTool(mock_vector_store)
 
-        # Act
-        result = tool.execute(query="very specific query")
-
-        # Assert
-        assert "No relevant content found" in result
+class TestCourseSearchTool:
+    """Test CourseSearchTool execution and functionality"""
 
-    def test_execute_formats_results_correctly(
-        self, mock_vector_store, sample_search_results
+    @pytest.fixture(scope="class")
+    def _search_tool(self, _mock_vector_store):
+        """CourseSearchTool over the session's vector store mock, built once"""
+        return CourseSearchTool(_mock_vector_store)
+
+    @pytest.fixture
+    def search_tool(self, _search_tool, mock_vector_store):
+        """The class's CourseSearchTool with a freshly reset store and no sources"""
+        _search_tool.last_sources = []
+        return _search_tool
+
+    @pytest.mark.parametrize(
+        "kwargs, results_fixture, expected_substrings",
+        [
+            pytest.param(
+                {"query": "What is MCP?"},
+                "sample_search_results",
+                ("[Introduction to MCP - Lesson 1]", "MCP (Model Context Protocol)"),
+                id="basic-query",
+            ),
+            pytest.param(
+                {"query": "What is MCP?", "course_name": "MCP"},
+                "sample_search_results",
+                ("Introduction to MCP",),
+                id="course-filter",
+            ),
+            pytest.param(
+                {"query": "MCP architecture", "lesson_number": 1},
+                "sample_search_results",
+                ("Lesson 1",),
+                id="lesson-filter",
+            ),
+            pytest.param(
+                {"query": "test query", "course_name": "NonExistent"},
+                "error_search_results",
+                ("No course found matching 'NonExistent'",),
+                id="course-not-found",
+            ),
+            pytest.param(
+                {"query": "very specific query"},
+                "empty_search_results",
+                ("No relevant content found",),
+                id="empty-results",
+            ),
+            # Each document gets its course and lesson header ahead of its text
+            pytest.param(
+                {"query": "What is MCP?"},
+                "sample_search_results",
+                ("Introduction to MCP", "Lesson", "MCP"),
+                id="formats-results",
+            ),
+        ],
+    )
+    def test_execute(
+        self,
+        request,
+        search_tool,
+        mock_vector_store,
+        kwargs,
+        results_fixture,
+        expected_substrings,
     ):
-        """Test that results are formatted with course and lesson information"""
+        """Test that execute searches with the given filters and formats the outcome"""
         # Arrange
-        tool = CourseSearchTool(mock_vector_store)
+        mock_vector_store.search.return_value = request.getfixturevalue(results_fixture)
 
         # Act
-        result = tool.execute(query="What is MCP?")
+        result = search_tool.execute(**kwargs)
 
         # Assert
-        # Check that course title is included
-        assert "Introduction to MCP" in result
-        # Check that lesson numbers are included
-        assert "Lesson" in result
-        # Check that actual content is included
-        assert "MCP" in result
-
-    def test_execute_tracks_sources(self, mock_vector_store, sample_search_results):
+        for expected in expected_substrings:
+            assert expected in result, expected
+        _assert_called_once_kwargs(
+            mock_vector_store.search,
+            query=kwargs["query"],
+            course_name=kwargs.get("course_name"),
+            lesson_number=kwargs.get("lesson_number"),
+        )
+
+    def test_execute_tracks_sources(self, search_tool, mock_vector_store):
         """Test that sources are properly tracked after search"""
         # Arrange
         mock_vector_store.get_lesson_link.return_value = "https://example.com/lesson/1"
-        tool = CourseSearchTool(mock_vector_store)
 
         # Act
-        _result = tool.execute(query="What is MCP?")
+        _result = search_tool.execute(query="What is MCP?")
 
         # Assert
-        assert len(tool.last_sources) == 2  # Two documents in sample results
-        assert all(isinstance(source, Source) for source in tool.last_sources)
-        assert tool.last_sources[0].course_title == "Introduction to MCP"
-        assert tool.last_sources[0].lesson_number == 1
-        assert tool.last_sources[1].lesson_number == 2
+        sources = search_tool.last_sources
+        assert len(sources) == 2  # Two documents in sample results
+        assert all(isinstance(source, Source) for source in sources)
+        assert sources[0].course_title == "Introduction to MCP"
+        assert sources[0].lesson_number == 1
+        assert sources[1].lesson_number == 2
 
 
 class TestToolManager:
     """Test ToolManager functionality"""
 
+    @pytest.fixture(scope="class")
+    def _registered_manager(self, _mock_vector_store):
+        """ToolManager with a CourseSearchTool registered, built once"""
+        manager = ToolManager()
+        manager.register_tool(CourseSearchTool(_mock_vector_store))
+        return manager
+
+    @pytest.fixture
+    def registered_manager(self, _registered_manager, mock_vector_store):
+        """The class's ToolManager with a freshly reset store and no sources"""
+        _registered_manager.reset_sources()
+        return _registered_manager
+
     def test_register_tool_success(self):
         """Test successful tool registration"""
         # Arrange
         manager = ToolManager()
-        mock_tool = MagicMock(spec=Tool)
-        mock_tool.get_tool_definition.return_value = {
-            "name": "test_tool",
-            "description": "A test tool",
-        }
+        stub_tool = _StubTool({"name": "test_tool", "description": "A test tool"})
 
         # Act
-        manager.register_tool(mock_tool)
+        manager.register_tool(stub_tool)
 
         # Assert
         assert "test_tool" in manager.tools
-        assert manager.tools["test_tool"] == mock_tool
+        assert manager.tools["test_tool"] is stub_tool
 
     def test_register_tool_no_name(self):
         """Test that tool registration fails without name"""
         # Arrange
         manager = ToolManager()
-        mock_tool = MagicMock(spec=Tool)
-        mock_tool.get_tool_definition.return_value = {}
+        stub_tool = _StubTool({})
 
         # Act & Assert
         with pytest.raises(ValueError, match="Tool must have a 'name'"):
-            manager.register_tool(mock_tool)
+            manager.register_tool(stub_tool)
 
-    def test_get_tool_definitions(self, mock_vector_store):
+    def test_get_tool_definitions(self, registered_manager):
         """Test retrieving all tool definitions"""
-        # Arrange
-        manager = ToolManager()
-        search_tool = CourseSearchTool(mock_vector_store)
-        manager.register_tool(search_tool)
-
         # Act
-        definitions = manager.get_tool_definitions()
+        definitions = registered_manager.get_tool_definitions()
 
         # Assert
         assert len(definitions) == 1
         assert definitions[0]["name"] == "search_course_content"
-        assert "description" in definitions[0]
-        assert "input_schema" in definitions[0]
+        assert {"description", "input_schema"} <= definitions[0].keys()
 
-    def test_execute_tool_found(self, mock_vector_store, sample_search_results):
-        """Test executing a registered tool"""
+    def test_get_tool_definitions_reused_until_register(self, mock_vector_store):
+        """Test that definitions are built once and rebuilt after registering a tool"""
         # Arrange
         manager = ToolManager()
-        search_tool = CourseSearchTool(mock_vector_store)
-        manager.register_tool(search_tool)
+        manager.register_tool(CourseSearchTool(mock_vector_store))
+        definitions = manager.get_tool_definitions()
 
+        # Act & Assert
+        assert manager.get_tool_definitions() is definitions
+
+        manager.register_tool(CourseOutlineTool(mock_vector_store))
+        assert len(manager.get_tool_definitions()) == 2
+
+    @pytest.mark.parametrize(
+        "tool_name, expected_substring, search_count",
+        [
+            pytest.param(
+                "search_course_content",
+                "[Introduction to MCP - Lesson 1]",
+                1,
+                id="found",
+            ),
+            pytest.param(
+                "nonexistent_tool",
+                "Tool 'nonexistent_tool' not found",
+                0,
+                id="not-found",
+            ),
+        ],
+    )
+    def test_execute_tool(
+        self,
+        registered_manager,
+        mock_vector_store,
+        tool_name,
+        expected_substring,
+        search_count,
+    ):
+        """Test that execute_tool runs a registered tool and reports unknown ones"""
         # Act
-        result = manager.execute_tool("search_course_content", query="test query")
+        result = registered_manager.execute_tool(tool_name, query="test query")
 
         # Assert
-        assert result is not None
-        assert isinstance(result, str)
-        mock_vector_store.search.assert_called_once()
-
-    def test_execute_tool_not_found(self):
-        """Test executing a non-existent tool"""
-        # Arrange
-        manager = ToolManager()
+        assert expected_substring in result
+        assert mock_vector_store.search.call_count == search_count
 
+    async def test_aexecute_tool_with_sources_matches_sync(self, registered_manager):
+        """Test that the async wrapper returns what execute_tool_with_sources does"""
         # Act
-        result = manager.execute_tool("nonexistent_tool", query="test")
+        result = await registered_manager.aexecute_tool_with_sources(
+            "search_course_content", query="test query"
+        )
 
         # Assert
-        assert "not found" in result.lower()
+        assert result == registered_manager.execute_tool_with_sources(
+            "search_course_content", query="test query"
+        )
 
-    def test_get_last_sources(self, mock_vector_store, sample_search_results):
+    def test_get_last_sources(self, registered_manager):
         """Test retrieving sources from last search"""
         # Arrange
-        manager = ToolManager()
-        search_tool = CourseSearchTool(mock_vector_store)
-        manager.register_tool(search_tool)
-
         # Execute a search to populate sources
-        manager.execute_tool("search_course_content", query="test query")
+        registered_manager.execute_tool("search_course_content", query="test query")
 
         # Act
-        sources = manager.get_last_sources()
+        sources = registered_manager.get_last_sources()
 
         # Assert
         assert len(sources) > 0
@@ -224,19 +257,28 @@ class TestToolManager:
         # Assert
         assert sources == []
 
-    def test_reset_sources(self, mock_vector_store, sample_search_results):
-        """Test resetting sources from all tools"""
+    def test_record_sources_merges_round_in_call_order(self, sample_sources):
+        """Test that a round's sources merge in call order and empty rounds keep them"""
         # Arrange
         manager = ToolManager()
-        search_tool = CourseSearchTool(mock_vector_store)
-        manager.register_tool(search_tool)
+        first, second = sample_sources
+
+        # Act
+        manager.record_sources([[second], [first, second]])
+        manager.record_sources([[], []])
 
+        # Assert
+        assert manager.get_last_sources() == [second, first]
+
+    def test_reset_sources(self, registered_manager):
+        """Test resetting sources from all tools"""
+        # Arrange
         # Execute a search to populate sources
-        manager.execute_tool("search_course_content", query="test query")
-        assert len(manager.get_last_sources()) > 0
+        registered_manager.execute_tool("search_course_content", query="test query")
+        assert len(registered_manager.get_last_sources()) > 0
 
         # Act
-        manager.reset_sources()
+        registered_manager.reset_sources()
 
         # Assert
-        assert manager.get_last_sources() == []
+        assert registered_manager.get_last_sources() == []
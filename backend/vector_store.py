@@ -3,6 +3,7 @@ from typing import Any
 
 import chromadb
 from chromadb.config import Settings
+
 from models import Course, CourseChunk
 
 
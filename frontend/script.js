@@ -91,7 +91,7 @@ async function sendMessage() {
     chatMessages.scrollTop = chatMessages.scrollHeight;
 
     try {
-        const response = await fetch(`${API_URL}/query`, {
+        const response = await fetch(`${API_URL}/query/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -104,16 +104,38 @@ async function sendMessage() {
 
         if (!response.ok) throw new Error('Query failed');
 
-        const data = await response.json();
-        
-        // Update session ID if new
-        if (!currentSessionId) {
-            currentSessionId = data.session_id;
-        }
+        // Render the answer as it streams in, replacing the loading dots
+        let answer = '';
+        let sources = null;
+        const content = loadingMessage.querySelector('.message-content');
+        await readEvents(response, (event) => {
+            switch (event.type) {
+                case 'session':
+                    // Update session ID if new
+                    if (!currentSessionId) {
+                        currentSessionId = event.session_id;
+                    }
+                    break;
+                case 'text':
+                    answer += event.text;
+                    content.innerHTML = marked.parse(answer);
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                    break;
+                case 'interim':
+                    // Text so far was Claude's note before searching, not the answer
+                    answer = '';
+                    break;
+                case 'sources':
+                    sources = event.sources;
+                    break;
+                case 'error':
+                    throw new Error(event.detail);
+            }
+        });
 
-        // Replace loading message with response
+        // Replace streaming message with the complete response and its sources
         loadingMessage.remove();
-        addMessage(data.answer, 'assistant', data.sources);
+        addMessage(answer, 'assistant', sources);
 
     } catch (error) {
         // Replace loading message with error
@@ -127,6 +149,25 @@ async function sendMessage() {
     }
 }
 
+// Call onEvent with each JSON payload of a server-sent events response
+async function readEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const messages = buffer.split('\n\n');
+        buffer = messages.pop();
+        for (const message of messages) {
+            if (message.startsWith('data: ')) {
+                onEvent(JSON.parse(message.slice('data: '.length)));
+            }
+        }
+    }
+}
+
 function createLoadingMessage() {
     const messageDiv = document.createElement('div');
     messageDiv.className = 'message assistant';